@@ -15,13 +15,24 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
+import bisect
+import collections
+import errno
+import heapq
+import http.client
+import http.server
+import itertools
 import os
+import selectors
 import socket
+import stat
 import struct
+import tempfile
 import threading
 import time
 import random
-import re
+import zlib
 
 
 version = "0.4.1"
@@ -34,12 +45,184 @@ class constants():
     MCAST_SYNC_READ_TIME = 0.5
     MCAST_SYNC_SEND_TIME = 0.5
     READ_OWN_MAX_COUNT = 3
+    HEARTBEAT_INTERVAL = None
+    HEARTBEAT_MISS_COUNT = 2
+    HEARTBEAT_MAX_INTERVAL = None
+    HEARTBEAT_BACKOFF = 1.5
+    PRIORITY_MAX = 1000
+    NODE_ID_SPACE = 1 << 20
+    CACHE_TTL = 0
+    NEGATIVE_CACHE_TTL = 0
+    FAST_LOOKUP = False
+    FAST_LOOKUP_TIME = 0.05
+    RETRY_FIRST_TIME = 0.03
+    RETRY_BACKOFF = 2
+    RETRY_JITTER = 0.2
+    RETRY_MAX_TIME = 1
+    PERSISTENT = False
+    SINGLE_FLIGHT = True
     DISCOVER_MSG_REQUEST = "Who's SERVICE?"
     DISCOVER_MSG_RESPONSE = "I'm SERVICE"
+    DISCOVER_MSG_BATCH_REQUEST = "Who's?"
+    DISCOVER_MSG_INSTANCES_LABEL = b'all'
     SERVICE_LABEL = "SERVICE"
     PORT_SEP = b'#'
     SYNC_SEP = b'.'
+    RESIGN_SEP = b'!'
+    MAX_SUCCESSORS = 64
+    ANNOUNCE_SUCCESSORS = 3
+    PROBE_SEP = b'?'
+    COLD_START_PROBE = False
+    PROBE_TIME = 0.1
+    PROBE_COUNT = 3
     MTU = 1500
+    BINARY_PROTOCOL = False
+    BINARY_MAGIC = 0xD5
+    BINARY_VERSION = 1
+    BINARY_SYNC = 1
+    BINARY_REQUEST = 2
+    BINARY_RESPONSE = 3
+    BINARY_RESIGN = 4
+    BINARY_PROBE = 5
+    BINARY_INSTANCES_REQUEST = 6
+    BINARY_INSTANCE = 7
+    LOAD_BALANCE = False
+    REQUEST_RATE = 200
+    REQUEST_BURST = 100
+    COALESCE_TIME = 0.01
+    MAX_SOURCES = 16384
+    MAX_SOURCES_PER_IP = 1024
+    IP_RATE_FACTOR = 64
+    HEALTH_INTERVAL = 1
+    HEALTH_FAILURES = 3
+    HEALTH_TIMEOUT = 0.5
+    HEALTH_IP = "127.0.0.1"
+    WEIGHT = 1
+    INSTANCES_TIME = 0.1
+    RESOLVER_PATH = os.path.join(tempfile.gettempdir(), "ServiceDiscovery.sock")
+    USE_RESOLVER = False
+    RESOLVER_MARGIN_TIME = 0.1
+    METRICS_PORT = None
+    METRICS_IP = "127.0.0.1"
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class binaryProtocol():
+    HEADER = struct.Struct("!BBBBIQH")
+
+
+    def serviceId(service_name):
+        if isinstance(service_name, str):
+            service_name = service_name.encode()
+        return zlib.crc32(service_name)
+
+
+    # The header only holds 16 bit ports, anything else goes out as no port
+    def packPort(port):
+        try:
+            port = int(port or 0)
+
+        except (TypeError, ValueError):
+            return 0
+
+        return port if 0 < port <= 0xFFFF else 0
+
+
+    def pack(msg_type, service_id, token=0, port=0):
+        return binaryProtocol.HEADER.pack(constants.BINARY_MAGIC, constants.BINARY_VERSION, msg_type, 0, service_id, token, binaryProtocol.packPort(port))
+
+
+    def unpack(msg):
+        # Text messages may start with the magic byte too (UTF-8 names), so only an exact header matches
+        if len(msg) != binaryProtocol.HEADER.size or msg[0] != constants.BINARY_MAGIC or msg[1] != constants.BINARY_VERSION:
+            return None
+
+        magic, version, msg_type, flags, service_id, token, port = binaryProtocol.HEADER.unpack(msg)
+        if flags != 0:
+            return None
+
+        return msg_type, service_id, token, port
+
+
+class histogram():
+
+    def __init__(self, buckets=constants.LATENCY_BUCKETS):
+        self.__buckets = buckets
+        self.__counts = [0] * (len(buckets) + 1)
+        self.__sum = 0
+        self.__mutex = threading.Lock()
+
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.__buckets, value)
+        with self.__mutex:
+            self.__counts[index] += 1
+            self.__sum += value
+
+
+    def snapshot(self):
+        with self.__mutex:
+            counts = list(self.__counts)
+            total = self.__sum
+
+        # Cumulative like Prometheus, the last count is the +Inf bucket
+        buckets = {}
+        cumulative = 0
+        for bound, count in zip(self.__buckets, counts):
+            cumulative += count
+            buckets[bound] = cumulative
+        return {"buckets": buckets, "count": sum(counts), "sum": total}
+
+
+class metricsServer():
+
+    def __init__(self, render, port, ip=constants.METRICS_IP):
+
+        class handler(http.server.BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+            def log_message(self, format, *args):
+                pass
+
+
+        self.__server = http.server.ThreadingHTTPServer((ip, port), handler)
+        self.__server.daemon_threads = True
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+
+
+    def sample(name, value, labels=None):
+        if labels:
+            name += "{" + ",".join('%s="%s"' % (key, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, label in labels.items()) + "}"
+        return "%s %s\n" % (name, float(value) if isinstance(value, float) else int(value))
+
+
+    def histogramSamples(name, snapshot):
+        text = ""
+        for bound, count in snapshot["buckets"].items():
+            text += metricsServer.sample(name + "_bucket", count, {"le": bound})
+        text += metricsServer.sample(name + "_bucket", snapshot["count"], {"le": "+Inf"})
+        text += metricsServer.sample(name + "_sum", float(snapshot["sum"]))
+        text += metricsServer.sample(name + "_count", snapshot["count"])
+        return text
+
+
+    def port(self):
+        return self.__server.server_address[1]
+
+
+    def close(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
 
 
 class mcast():
@@ -66,14 +249,16 @@ class mcast():
 
     def read(self, timeout=-1):
 
-        current_epoch_time = float(time.time())
+        deadline = time.monotonic() + timeout
         while self.__open:
             try:
+                if timeout >= 0:
+                    self.__sock.settimeout(max(0, min(0.1, deadline - time.monotonic())))
                 data, (ip, port) = self.__sock.recvfrom(4096)
                 return data, ip, port
 
             except socket.timeout:
-                if timeout >= 0 and float(time.time()) - current_epoch_time >= timeout:
+                if timeout >= 0 and time.monotonic() >= deadline:
                     return None, None, None
 
             except socket.error:
@@ -83,6 +268,10 @@ class mcast():
         return None, None, None
 
 
+    def fileno(self):
+        return self.__sock.fileno()
+
+
     def send(self, msg):
         if isinstance(msg, str):
             msg = msg.encode()
@@ -115,14 +304,16 @@ class udpRandomPortListener():
 
     def read(self, timeout=-1):
 
-        current_epoch_time = int(time.time())
+        deadline = time.monotonic() + timeout
         while self.__open:
             try:
+                if timeout >= 0:
+                    self.__sock.settimeout(max(0, min(0.1, deadline - time.monotonic())))
                 data, (ip, port) = self.__sock.recvfrom(constants.MTU)
                 return data, ip, port
 
             except socket.timeout:
-                if timeout >= 0 and int(time.time()) - current_epoch_time >= timeout:
+                if timeout >= 0 and time.monotonic() >= deadline:
                     return None, None, None
 
             except socket.error:
@@ -131,6 +322,10 @@ class udpRandomPortListener():
         return None, None, None
 
 
+    def fileno(self):
+        return self.__sock.fileno()
+
+
     def send(self, ip, port, msg):
         if isinstance(msg, str):
             msg = msg.encode()
@@ -166,14 +361,16 @@ class udpClient():
 
     def read(self, timeout=-1):
 
-        current_epoch_time = int(time.time())
+        deadline = time.monotonic() + timeout
         while self.__open:
             try:
+                if timeout >= 0:
+                    self.__sock.settimeout(max(0, min(0.1, deadline - time.monotonic())))
                 data = self.__sock.recv(constants.MTU)
                 return data
 
             except socket.timeout:
-                if timeout >= 0 and int(time.time()) - current_epoch_time >= timeout:
+                if timeout >= 0 and time.monotonic() >= deadline:
                     return None
 
             except socket.error:
@@ -222,203 +419,2592 @@ class container:
     pass
 
 
-class daemon():
+class retrySchedule():
 
-    def __init__(self, service_name):
-        self.__thread = None
-        self.__shared_container = container()
-        self.__shared_container.sync_rx_thread = None
-        self.__shared_container.sync_tx_thread = None
-        self.__shared_container.enable = True
-        self.__shared_container.port = None
-        self.__shared_container.run = True
-        self.__shared_container.master_candidate = True
-        self.__shared_container.read_own_it = 0
-        self.__shared_container.service_name = service_name
-        self.__shared_container.mcast_listen_request = mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT)
-        self.__shared_container.mcast_sync = mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SYNC_PORT)
-        self.__shared_container.sync_token = int(random.random() * 1000000) + 1
+    def __init__(self, timeout, first=constants.RETRY_FIRST_TIME, backoff=constants.RETRY_BACKOFF, jitter=constants.RETRY_JITTER, clock=time.monotonic, rng=random):
+        self.__clock = clock
+        self.__random = rng
+        self.__deadline = clock() + timeout
+        self.__interval = first
+        self.__backoff = backoff
+        self.__jitter = jitter
 
 
-    def __del__(self):
-        self.stop()
+    # Time of the next send, the first one right away, None once the deadline is over
+    def next(self):
+        now = self.__clock()
+        if now >= self.__deadline:
+            return None
 
+        interval = self.__interval * self.__random.uniform(1 - self.__jitter, 1 + self.__jitter)
+        self.__interval = min(self.__interval * self.__backoff, constants.RETRY_MAX_TIME)
+        return min(now + interval, self.__deadline)
 
-    def __readSync(shared_container):
 
-        while shared_container.run:
-            received_response, ip, port = shared_container.mcast_sync.read(constants.MCAST_SYNC_READ_TIME*2)
+    @property
+    def deadline(self):
+        return self.__deadline
 
-            if not received_response:
-                return None
 
-            elif re.match("^" + shared_container.service_name + "\\.\\d*$", received_response.decode()):
-                return int(received_response.split(constants.SYNC_SEP)[1].decode())
+class faultInjector():
 
-        return None
+    def __init__(self, drop=0.0, delayed=0.0, delay=0.0, seed=None):
+        self.__drop = drop
+        self.__delayed = delayed
+        self.__delay = delay
+        self.__random = random.Random(seed)
+        self.__mutex = threading.Lock()
+        self.dropped = 0
+        self.delayed = 0
 
 
-    def __run(shared_container):
+    def drops(self):
+        with self.__mutex:
+            if self.__random.random() < self.__drop:
+                self.dropped += 1
+                return True
+            return False
 
-        expected_request = constants.DISCOVER_MSG_REQUEST.replace(constants.SERVICE_LABEL, shared_container.service_name).encode()
-        response = constants.DISCOVER_MSG_RESPONSE.replace(constants.SERVICE_LABEL, shared_container.service_name).encode()
 
+    def delays(self):
+        with self.__mutex:
+            if self.__random.random() < self.__delayed:
+                self.delayed += 1
+                return self.__delay
+            return 0
 
-        while shared_container.run:
-            request, ip, port = shared_container.mcast_listen_request.read()
-            if not request:
-                break
 
+    def wrap(self, sock, clock=time.monotonic):
+        return faultySocket(self, sock, clock)
 
-            request_split = request.split(constants.PORT_SEP)
-            if request_split[0] == expected_request and shared_container.sync_token == 0:
 
-                client_response = udpClient(ip, int(request_split[1]))
-                if shared_container.port:
-                    client_response.send(response + constants.PORT_SEP + str(shared_container.port).encode())
-                else:
-                    client_response.send(response)
+class faultySocket():
 
+    def __init__(self, injector, sock, clock=time.monotonic):
+        self.__injector = injector
+        self.__sock = sock
+        self.__clock = clock
 
-        # Wait threads
-        shared_container.sync_rx_thread.join()
-        shared_container.sync_tx_thread.join()
 
+    def __getattr__(self, name):
+        return getattr(self.__sock, name)
 
-    def __sync_tx(shared_container):
 
-        while shared_container.run:
+    def read(self, timeout=-1):
+        deadline = self.__clock() + timeout
+        while True:
+            data, ip, port = self.__sock.read(max(0, deadline - self.__clock()) if timeout >= 0 else timeout)
+            if not data or not self.__injector.drops():
+                return data, ip, port
+
+            elif timeout >= 0 and self.__clock() >= deadline:
+                return None, None, None
+
+
+    def send(self, *args):
+        if self.__injector.drops():
+            return True
+
+        delay = self.__injector.delays()
+        if delay:
+            threading.Timer(delay, self.__sock.send, args).start()
+            return True
+
+        return self.__sock.send(*args)
+
+
+class udpTransport():
+
+    local_resolver = True
+
+    def __init__(self):
+        self.monotonic = time.monotonic
+        self.random = random
+
+
+    def mcast(self, ip, port):
+        return mcast(ip, port)
+
+
+    def listener(self):
+        return udpRandomPortListener()
+
+
+    def selector(self):
+        return selectors.DefaultSelector()
 
-            time.sleep(constants.MCAST_SYNC_SEND_TIME)
 
-            if shared_container.enable and shared_container.master_candidate:
-                shared_container.mcast_sync.send(shared_container.service_name.encode() + constants.SYNC_SEP + str(shared_container.sync_token).encode())
+    # A wakeup is pending as long as one byte is queued, never block the sender on a full pair
+    def socketpair(self):
+        rx, tx = socket.socketpair()
+        tx.setblocking(False)
+        return rx, tx
 
 
-    def __sync_rx(shared_container):
+    def wait(self, event, timeout):
+        return event.wait(timeout)
 
 
+    def spawn(self, target, *args):
+        threading.Thread(target=target, daemon=True, args=args).start()
+
+
+    def __loop(step, deadline, shared_container):
         while shared_container.run:
+            when = deadline(shared_container)
+            step(shared_container, max(0, when - time.monotonic()) if when != None else None)
 
-            sync_token = daemon.__readSync(shared_container)
-            if sync_token == None:
-                shared_container.master_candidate = True
-                shared_container.read_own_it = 0
 
-            elif sync_token < shared_container.sync_token:
-                shared_container.master_candidate = False
-                shared_container.read_own_it = 0
+    # Engines run step until stopped, waiting on their selector at most until deadline
+    def start(self, step, deadline, shared_container) -> threading.Thread:
+        thread = threading.Thread(target=udpTransport.__loop, daemon=True, args=[step, deadline, shared_container])
+        thread.start()
+        return thread
 
-            elif sync_token == shared_container.sync_token:
-                shared_container.read_own_it += 1
 
-                if shared_container.read_own_it >= constants.READ_OWN_MAX_COUNT:
-                    shared_container.sync_token = 0
+defaultTransport = udpTransport()
 
-            else:
-                shared_container.read_own_it = 0
 
+class simNetwork():
 
-    def run(self) -> threading.Thread:
-        self.__shared_container.sync_tx_thread = threading.Thread(target=daemon.__sync_tx, daemon=True, args=[self.__shared_container])
-        self.__shared_container.sync_tx_thread.start()
-        self.__shared_container.sync_rx_thread = threading.Thread(target=daemon.__sync_rx, daemon=True, args=[self.__shared_container])
-        self.__shared_container.sync_rx_thread.start()
-        self.__thread = threading.Thread(target=daemon.__run, daemon=True, args=[self.__shared_container])
-        self.__thread.start()
-        return self.__thread
+    def __init__(self, latency=0.0005, jitter=0.0, drop=0.0, seed=0):
+        self.now = 0.0
+        self.random = random.Random(seed)
+        self.delivered = 0
+        self.dropped = 0
+        self.__latency = latency
+        self.__jitter = jitter
+        self.__drop = drop
+        self.__events = []
+        self.__seq = 0
+        self.__groups = {}
+        self.__unicast = {}
+        self.__next_port = 20000
+        self.__hosts = 0
+        self.__isolated = set()
 
 
-    def stop(self):
-        self.__shared_container.run = False
-        self.__shared_container.mcast_listen_request.close()
-        self.__shared_container.mcast_sync.close()
-        if self.__thread:
-            self.__thread.join()
-        if self.__shared_container.sync_tx_thread:
-            self.__shared_container.sync_tx_thread.join()
-        if self.__shared_container.sync_rx_thread:
-            self.__shared_container.sync_rx_thread.join()
+    def node(self, ip=None):
+        self.__hosts += 1
+        return simTransport(self, ip if ip else "10.%d.%d.%d" % (self.__hosts >> 16 & 255, self.__hosts >> 8 & 255, self.__hosts & 255))
 
-    def getEnable(self):
-        return self.__shared_container.enable
 
+    def schedule(self, when, callback, *args):
+        self.__seq += 1
+        heapq.heappush(self.__events, (when, self.__seq, callback, args))
 
-    def setEnable(self, enable):
-        if not self.__shared_container.enable and enable:
-            self.__shared_container.sync_token = int(random.random() * 1000000) + 1
-        self.__shared_container.enable = enable
 
+    def port(self):
+        self.__next_port += 1
+        return self.__next_port
 
-    def isMaster(self):
-        return self.__shared_container.sync_token == 0
 
+    def join(self, group, sock):
+        self.__groups.setdefault(group, {})[id(sock)] = sock
 
-    def setPort(self, port:int):
-        self.__shared_container.port = port
 
+    def bind(self, address, sock):
+        self.__unicast[address] = sock
 
-    def getPort(self) -> int:
-        return self.__shared_container.port
 
+    def unbind(self, sock, group=None):
+        if group:
+            self.__groups.get(group, {}).pop(id(sock), None)
+        elif self.__unicast.get((sock.ip, sock.port)) is sock:
+            del self.__unicast[(sock.ip, sock.port)]
 
-class client():
 
-    def __getServiceIP(self, service_name, timeout=5, retry=0) -> str:
-        mcast_send_request = mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT)
-        listen_respose = udpRandomPortListener()
+    # Isolated hosts neither send nor receive, like a crashed or partitioned machine
+    def isolate(self, ip):
+        self.__isolated.add(ip)
 
-        request = constants.DISCOVER_MSG_REQUEST.replace(constants.SERVICE_LABEL, service_name).encode() + constants.PORT_SEP + str(listen_respose.port).encode()
-        expected_response = constants.DISCOVER_MSG_RESPONSE.replace(constants.SERVICE_LABEL, service_name).encode()
 
-        sync_listener = mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SYNC_PORT)
+    def heal(self, ip):
+        self.__isolated.discard(ip)
 
-        i = 0
 
+    def send(self, source, destination, msg):
+        if destination in self.__groups:
+            receivers = list(self.__groups[destination].values())
+        else:
+            receivers = [self.__unicast[destination]] if destination in self.__unicast else []
 
-        # Wait sync end
-        start_time = float(time.time())
-        while True:
-            received_response, ip, port = sync_listener.read(constants.MCAST_SYNC_READ_TIME*2)
+        if self.__isolated:
+            if source[0] in self.__isolated:
+                self.dropped += len(receivers)
+                return
+            reachable = [receiver for receiver in receivers if receiver.ip not in self.__isolated]
+            self.dropped += len(receivers) - len(reachable)
+            receivers = reachable
 
-            if not received_response:
-                return None, None
+        # Equal delays share one event, a multicast to every member costs a single heap push
+        if not self.__drop and not self.__jitter:
+            self.delivered += len(receivers)
+            self.schedule(self.now + self.__latency, simNetwork.__deliver, receivers, msg, source)
+            return
 
-            elif re.match("^" + service_name + "\\.\\d*$", received_response.decode()):
-                token = int(received_response.split(constants.SYNC_SEP)[1].decode())
-                if token == 0:
-                    break
+        for receiver in receivers:
+            if self.__drop and self.random.random() < self.__drop:
+                self.dropped += 1
+                continue
+            self.delivered += 1
+            self.schedule(self.now + self.__latency + self.random.uniform(0, self.__jitter), simNetwork.__deliver, [receiver], msg, source)
 
-            elif float(time.time()) - start_time > timeout:
-                return None, None
 
+    def __deliver(receivers, msg, source):
+        for receiver in receivers:
+            receiver.deliver(msg, source)
 
-        # Send request
-        while retry < 0 or i <= retry:
 
-            mcast_send_request.send(request)
-            received_response, ip, port = listen_respose.read(timeout)
+    # Process events in time order until predicate holds or the clock reaches until
+    def run(self, until=None, predicate=None):
+        events = self.__events
+        while not (predicate and predicate()):
+            if not events or (until != None and events[0][0] > until):
+                if until != None:
+                    self.now = max(self.now, until)
+                return bool(predicate and predicate())
 
-            if received_response:
-                response_split = received_response.split(constants.PORT_SEP)
+            when, seq, callback, args = heapq.heappop(events)
+            self.now = max(self.now, when)
+            callback(*args)
+        return True
 
-                if response_split[0] == expected_response:
-                    try:
-                        return ip, int(response_split[1]) if len(response_split) > 1 else None
 
-                    except:
-                        pass
+    def advance(self, seconds):
+        self.run(self.now + seconds)
 
-            i += 1
 
-        return None, None
+class simTransport():
 
+    local_resolver = False
 
-    def getServiceIP(self, service_name, timeout=5, retry=0):
-        ip, metadata = self.__getServiceIP(service_name, timeout, retry)
-        return ip
+    def __init__(self, network, ip):
+        self.network = network
+        self.ip = ip
+        self.random = network.random
 
 
-    def getServiceIPAndPort(self, service_name, timeout=5, retry=0):
-        ip, port = self.__getServiceIP(service_name, timeout, retry)
-        return ip, port
+    def monotonic(self):
+        return self.network.now
+
+
+    def mcast(self, ip, port):
+        return simMcast(self, (ip, port))
+
+
+    def listener(self):
+        return simListener(self)
+
+
+    def selector(self):
+        return simSelector()
+
+
+    def socketpair(self):
+        pipe = simPipe()
+        return pipe, pipe
+
+
+    def wait(self, event, timeout):
+        return self.network.run(self.network.now + timeout if timeout != None else None, event.is_set)
+
+
+    def spawn(self, target, *args):
+        self.network.schedule(self.network.now, target, *args)
+
+
+    def start(self, step, deadline, shared_container):
+        process = simProcess(self.network, step, deadline, shared_container)
+        shared_container.selector.process = process
+        process.poke()
+        return process
+
+
+class simSocket():
+
+    def __init__(self, transport, port):
+        self.network = transport.network
+        self.ip = transport.ip
+        self.port = port
+        self.owner = None
+        self.queue = collections.deque()
+        self.__open = True
+
+
+    def deliver(self, msg, source):
+        if self.__open:
+            self.queue.append((msg, source[0], source[1]))
+            if self.owner:
+                self.owner.ready()
+
+
+    def pending(self):
+        return len(self.queue)
+
+
+    def read(self, timeout=-1):
+        if not self.queue and timeout != 0:
+            self.network.run(self.network.now + timeout if timeout >= 0 else None, self.pending)
+
+        if self.queue:
+            return self.queue.popleft()
+        return None, None, None
+
+
+    def fileno(self):
+        return -1
+
+
+    def close(self):
+        self.__open = False
+        self.queue.clear()
+        self.network.unbind(self)
+
+
+class simMcast(simSocket):
+
+    def __init__(self, transport, group):
+        super().__init__(transport, group[1])
+        self.__group = group
+        self.network.join(group, self)
+
+
+    def send(self, msg):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.network.send((self.ip, self.port), self.__group, msg)
+        return True
+
+
+    def close(self):
+        super().close()
+        self.network.unbind(self, self.__group)
+
+
+class simListener(simSocket):
+
+    def __init__(self, transport):
+        super().__init__(transport, transport.network.port())
+        self.network.bind((self.ip, self.port), self)
+
+
+    def send(self, ip, port, msg):
+        if isinstance(msg, str):
+            msg = msg.encode()
+        self.network.send((self.ip, self.port), (ip, port), msg)
+
+
+class simPipe():
+
+    def __init__(self):
+        self.owner = None
+        self.__pending = False
+
+
+    def pending(self):
+        return self.__pending
+
+
+    def send(self, data):
+        self.__pending = True
+        if self.owner:
+            self.owner.ready()
+        return len(data)
+
+
+    def recv(self, size):
+        self.__pending = False
+        return b'\0'
+
+
+    def fileno(self):
+        return -1
+
+
+    def close(self):
+        self.__pending = False
+
+
+class simSelector():
+
+    def __init__(self):
+        self.process = None
+        self.__keys = {}
+
+
+    def register(self, fileobj, events, data=None):
+        key = selectors.SelectorKey(fileobj, -1, events, data)
+        self.__keys[id(fileobj)] = key
+        fileobj.owner = self
+        return key
+
+
+    def unregister(self, fileobj):
+        fileobj.owner = None
+        return self.__keys.pop(id(fileobj), None)
+
+
+    def ready(self):
+        if self.process:
+            self.process.poke()
+
+
+    def pending(self):
+        return any(key.fileobj.pending() for key in self.__keys.values())
+
+
+    # One entry per queued datagram, a single step drains every socket
+    def select(self, timeout=None):
+        return [(key, selectors.EVENT_READ) for key in list(self.__keys.values()) for i in range(key.fileobj.pending())]
+
+
+    def close(self):
+        self.__keys = {}
+
+
+class simProcess():
+
+    def __init__(self, network, step, deadline, shared_container):
+        self.__network = network
+        self.__step = step
+        self.__deadline = deadline
+        self.__shared_container = shared_container
+        self.__poked = False
+        self.__wake_at = None
+
+
+    def poke(self):
+        if not self.__poked:
+            self.__poked = True
+            self.__network.schedule(self.__network.now, self.__run, None)
+
+
+    def __run(self, wake_at):
+        # Stale wake up, a later step already moved the deadline
+        if wake_at != None and wake_at != self.__wake_at:
+            return
+        if wake_at == None:
+            self.__poked = False
+        else:
+            self.__wake_at = None
+
+        shared_container = self.__shared_container
+        if not shared_container.run:
+            return
+
+        self.__step(shared_container, 0)
+        while shared_container.run and shared_container.selector.pending():
+            self.__step(shared_container, 0)
+
+        when = self.__deadline(shared_container) if shared_container.run else None
+        if when != None and when != self.__wake_at:
+            self.__wake_at = when
+            self.__network.schedule(when, self.__run, when)
+
+
+    def join(self, timeout=None):
+        pass
+
+
+    def is_alive(self):
+        return self.__shared_container.run
+
+
+class singleFlight():
+
+    def __init__(self):
+        self.__mutex = threading.Lock()
+        self.__flights = {}
+
+
+    def join(self, key):
+        with self.__mutex:
+            flight = self.__flights.get(key)
+            if flight:
+                return flight, False
+
+            flight = container()
+            flight.event = threading.Event()
+            flight.result = None
+            self.__flights[key] = flight
+            return flight, True
+
+
+    def land(self, key, flight, result):
+        with self.__mutex:
+            if self.__flights.get(key) is flight:
+                del self.__flights[key]
+        flight.result = result
+        flight.event.set()
+
+
+    def wait(self, flight, timeout):
+        if flight.event.wait(timeout):
+            return flight.result
+        return None
+
+
+class randomElection():
+
+    def __init__(self, rng=random):
+        self.__random = rng
+
+
+    def token(self):
+        return int(self.__random.random() * 1000000) + 1
+
+
+class priorityElection():
+
+    def __init__(self, priority=0, node_id=None):
+        self.__priority = min(max(int(priority), 0), constants.PRIORITY_MAX)
+        self.__node_id = node_id if node_id != None else random.randrange(constants.NODE_ID_SPACE)
+
+
+    # Lowest token wins, higher priority first and node id breaks ties
+    def token(self):
+        return (constants.PRIORITY_MAX - self.__priority) * constants.NODE_ID_SPACE + self.__node_id % constants.NODE_ID_SPACE + 1
+
+
+    @property
+    def priority(self):
+        return self.__priority
+
+
+    @property
+    def node_id(self):
+        return self.__node_id
+
+
+class tcpHealthCheck():
+
+    def __init__(self, ip=constants.HEALTH_IP, port=None, timeout=constants.HEALTH_TIMEOUT):
+        self.__ip = ip
+        self.__port = port
+        self.__timeout = timeout
+
+
+    def healthy(self, service_port):
+        port = self.__port if self.__port else service_port
+        if not port:
+            return False
+
+        try:
+            socket.create_connection((self.__ip, port), self.__timeout).close()
+            return True
+
+        except OSError:
+            return False
+
+
+class httpHealthCheck():
+
+    def __init__(self, path="/", ip=constants.HEALTH_IP, port=None, timeout=constants.HEALTH_TIMEOUT):
+        self.__path = path
+        self.__ip = ip
+        self.__port = port
+        self.__timeout = timeout
+
+
+    def healthy(self, service_port):
+        port = self.__port if self.__port else service_port
+        if not port:
+            return False
+
+        connection = http.client.HTTPConnection(self.__ip, port, timeout=self.__timeout)
+        try:
+            connection.request("GET", self.__path)
+            return 200 <= connection.getresponse().status < 400
+
+        except (OSError, http.client.HTTPException):
+            return False
+
+        finally:
+            connection.close()
+
+
+class callableHealthCheck():
+
+    def __init__(self, function):
+        self.__function = function
+
+
+    def healthy(self, service_port):
+        return bool(self.__function())
+
+
+class roundRobinBalancer():
+
+    def __init__(self):
+        self.__next = {}
+        self.__mutex = threading.Lock()
+
+
+    def select(self, service_name, instances):
+        with self.__mutex:
+            index = self.__next.get(service_name, 0)
+            self.__next[service_name] = index + 1
+        return instances[index % len(instances)]
+
+
+class weightedBalancer():
+
+    def select(self, service_name, instances):
+        return random.choices(instances, [weight for ip, port, weight in instances])[0]
+
+
+class daemonHost():
+
+    def __init__(self, binary_protocol=constants.BINARY_PROTOCOL, sync_send_time=constants.MCAST_SYNC_SEND_TIME, sync_read_time=constants.MCAST_SYNC_READ_TIME, read_own_max_count=constants.READ_OWN_MAX_COUNT, heartbeat_interval=constants.HEARTBEAT_INTERVAL, heartbeat_miss_count=constants.HEARTBEAT_MISS_COUNT, cold_start_probe=constants.COLD_START_PROBE, probe_time=constants.PROBE_TIME, probe_count=constants.PROBE_COUNT, metrics_port=constants.METRICS_PORT, load_balance=constants.LOAD_BALANCE, heartbeat_max_interval=constants.HEARTBEAT_MAX_INTERVAL, health_interval=constants.HEALTH_INTERVAL, health_failures=constants.HEALTH_FAILURES, request_rate=constants.REQUEST_RATE, request_burst=constants.REQUEST_BURST, coalesce_time=constants.COALESCE_TIME, transport=None):
+        self.__thread = None
+        self.__metrics = None
+        self.__shared_container = container()
+        self.__shared_container.transport = transport if transport else defaultTransport
+        self.__shared_container.run = True
+        self.__shared_container.sync_send_time = sync_send_time
+        self.__shared_container.sync_read_time = sync_read_time
+        self.__shared_container.read_own_max_count = read_own_max_count
+        self.__shared_container.heartbeat_interval = heartbeat_interval if heartbeat_interval else sync_send_time
+        self.__shared_container.heartbeat_miss_count = heartbeat_miss_count
+
+        # Clients wait two sync read periods for a master beacon, keep at least two beacons in that window
+        heartbeat_max_interval = min(heartbeat_max_interval, constants.MCAST_SYNC_READ_TIME) if heartbeat_max_interval else None
+        self.__shared_container.heartbeat_max_interval = max(heartbeat_max_interval, self.__shared_container.heartbeat_interval) if heartbeat_max_interval else self.__shared_container.heartbeat_interval
+        self.__shared_container.cold_start_probe = cold_start_probe
+        self.__shared_container.probe_time = probe_time
+        self.__shared_container.probe_count = probe_count
+        self.__shared_container.load_balance = load_balance
+        self.__shared_container.health_interval = health_interval
+        self.__shared_container.health_failures = health_failures
+        self.__shared_container.requests_received = 0
+        self.__shared_container.requests_answered = 0
+        self.__shared_container.requests_rate_limited = 0
+        self.__shared_container.requests_coalesced = 0
+        self.__shared_container.callback_errors = 0
+        self.__shared_container.request_rate = request_rate
+        self.__shared_container.request_burst = request_burst
+        self.__shared_container.coalesce_time = coalesce_time
+        self.__shared_container.sources = collections.OrderedDict()
+        self.__shared_container.sources_count = 0
+        self.__shared_container.beacons_sent = 0
+        self.__shared_container.beacons_received = 0
+        self.__shared_container.binary_protocol = binary_protocol
+        self.__shared_container.services = {}
+        self.__shared_container.services_by_id = {}
+        self.__shared_container.services_mutex = threading.Lock()
+        self.__shared_container.timers = []
+        self.__shared_container.timers_seq = 0
+        self.__shared_container.timers_mutex = threading.Lock()
+        self.__shared_container.mcast_listen_request = self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT)
+        self.__shared_container.mcast_sync = self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SYNC_PORT)
+        self.__shared_container.reply_socket = self.__shared_container.transport.listener()
+        self.__shared_container.wakeup_rx, self.__shared_container.wakeup_tx = self.__shared_container.transport.socketpair()
+        self.__shared_container.selector = self.__shared_container.transport.selector()
+        self.__shared_container.selector.register(self.__shared_container.mcast_listen_request, selectors.EVENT_READ, daemonHost.__readRequest)
+        self.__shared_container.selector.register(self.__shared_container.mcast_sync, selectors.EVENT_READ, daemonHost.__readSync)
+        self.__shared_container.selector.register(self.__shared_container.wakeup_rx, selectors.EVENT_READ, daemonHost.__readWakeup)
+        self.__metrics = metricsServer(self.__prometheus, metrics_port) if metrics_port != None else None
+
+
+    def __del__(self):
+        self.stop()
+
+
+    def __service(self, service_name):
+        return self.__shared_container.services[service_name.encode()]
+
+
+    def __schedule(shared_container, when, callback, *args):
+        with shared_container.timers_mutex:
+            shared_container.timers_seq += 1
+            heapq.heappush(shared_container.timers, (when, shared_container.timers_seq, callback, args))
+
+
+    def __wakeup(shared_container):
+        try:
+            shared_container.wakeup_tx.send(b'\0')
+
+        except socket.error:
+            pass
+
+
+    def __readWakeup(shared_container):
+        try:
+            shared_container.wakeup_rx.recv(4096)
+
+        except socket.error:
+            pass
+
+
+    def __reply(shared_container, response, ip, port):
+        try:
+            shared_container.reply_socket.send(ip, port, response)
+            shared_container.requests_answered += 1
+
+        except (OSError, OverflowError):
+            pass
+
+
+    def __pruneSources(shared_container, now):
+        sources = shared_container.sources
+        refill_time = shared_container.request_burst / shared_container.request_rate if shared_container.request_rate else 0
+        idle_time = max(refill_time, shared_container.coalesce_time)
+
+        # Least recently seen addresses go first, idle ones would start over with full buckets anyway
+        while sources:
+            host = next(iter(sources.values()))
+            if now - host.seen < idle_time and shared_container.sources_count < constants.MAX_SOURCES:
+                break
+            sources.popitem(last=False)
+            shared_container.sources_count -= len(host.buckets)
+
+
+    # One bucket per reply address and service, a shared client socket may resolve many services.
+    # The reply port comes from the payload, so each source ip also shares one larger bucket.
+    def __admit(shared_container, request, ip, port, service):
+        if not shared_container.request_rate and not shared_container.coalesce_time:
+            return True
+
+        now = shared_container.transport.monotonic()
+        key = (port, service.service_name)
+        host = shared_container.sources.get(ip)
+        source = host.buckets.get(key) if host else None
+        if source == None:
+            daemonHost.__pruneSources(shared_container, now)
+            host = shared_container.sources.get(ip)
+            if host == None:
+                host = container()
+                host.tokens = shared_container.request_burst * constants.IP_RATE_FACTOR
+                host.updated = now
+                host.buckets = collections.OrderedDict()
+                shared_container.sources[ip] = host
+
+            if len(host.buckets) >= constants.MAX_SOURCES_PER_IP:
+                host.buckets.popitem(last=False)
+                shared_container.sources_count -= 1
+            source = container()
+            source.tokens = shared_container.request_burst
+            source.updated = now
+            source.last_request = None
+            source.last_time = now
+            host.buckets[key] = source
+            shared_container.sources_count += 1
+        else:
+            host.buckets.move_to_end(key)
+        shared_container.sources.move_to_end(ip)
+        host.seen = now
+
+        # The same lookup again from the same source, the reply just sent answers it
+        if request == source.last_request and now - source.last_time < shared_container.coalesce_time:
+            shared_container.requests_coalesced += 1
+            return False
+
+        if shared_container.request_rate:
+            source.tokens = min(shared_container.request_burst, source.tokens + (now - source.updated) * shared_container.request_rate)
+            host.tokens = min(shared_container.request_burst * constants.IP_RATE_FACTOR, host.tokens + (now - host.updated) * shared_container.request_rate * constants.IP_RATE_FACTOR)
+            source.updated = now
+            host.updated = now
+            if source.tokens < 1 or host.tokens < 1:
+                shared_container.requests_rate_limited += 1
+                return False
+            source.tokens -= 1
+            host.tokens -= 1
+
+        source.updated = now
+        source.last_request = request
+        source.last_time = now
+        return True
+
+
+    def __encodeResponse(service):
+        response = constants.DISCOVER_MSG_RESPONSE.replace(constants.SERVICE_LABEL, service.service_name).encode()
+        if service.port:
+            response += constants.PORT_SEP + str(service.port).encode()
+        service.response = response
+        service.binary_response = binaryProtocol.pack(constants.BINARY_RESPONSE, service.service_id, 0, service.port)
+        service.instance_response = response if service.port else response + constants.PORT_SEP
+        service.instance_response += constants.PORT_SEP + str(service.weight).encode()
+        service.binary_instance_response = binaryProtocol.pack(constants.BINARY_INSTANCE, service.service_id, service.weight, service.port)
+
+
+    def __isInstance(shared_container, service):
+        return service.sync_token == 0 or (shared_container.load_balance and service.active)
+
+
+    def __readRequest(shared_container):
+
+        request, ip, port = shared_container.mcast_listen_request.read(0)
+        if not request:
+            return
+        shared_container.requests_received += 1
+
+        binary_request = binaryProtocol.unpack(request)
+        if binary_request:
+            msg_type, service_id, token, port = binary_request
+            service = shared_container.services_by_id.get(service_id)
+            if not port:
+                return
+
+            if msg_type == constants.BINARY_REQUEST and service and service.sync_token == 0:
+                if daemonHost.__admit(shared_container, request, ip, port, service):
+                    daemonHost.__reply(shared_container, service.binary_response, ip, port)
+            elif msg_type == constants.BINARY_INSTANCES_REQUEST and service and daemonHost.__isInstance(shared_container, service):
+                if daemonHost.__admit(shared_container, request, ip, port, service):
+                    daemonHost.__reply(shared_container, service.binary_instance_response, ip, port)
+            return
+
+        request_split = request.split(constants.PORT_SEP)
+        if len(request_split) < 2 or not request_split[1].isdigit():
+            return
+
+        # Replies only go to ports a socket can use
+        port = int(request_split[1])
+        if not 0 < port <= 0xFFFF:
+            return
+
+        label = request_split[0]
+        if label == shared_container.batch_request:
+            service_names = request_split[2:]
+
+        elif label.startswith(shared_container.request_prefix) and label.endswith(shared_container.request_suffix):
+            service_names = [label[len(shared_container.request_prefix):len(label) - len(shared_container.request_suffix)]]
+
+            # Instance requests are tagged after the port, where a service name can not reach
+            if request_split[2:3] == [constants.DISCOVER_MSG_INSTANCES_LABEL]:
+                service = shared_container.services.get(service_names[0])
+                if service and daemonHost.__isInstance(shared_container, service):
+                    if daemonHost.__admit(shared_container, request, ip, port, service):
+                        daemonHost.__reply(shared_container, service.instance_response, ip, port)
+                return
+
+        else:
+            return
+
+
+        # Only the daemons that answer spend source state on the request
+        services = shared_container.services
+        for service_name in service_names:
+            service = services.get(service_name)
+            if service and service.sync_token == 0 and daemonHost.__admit(shared_container, request, ip, port, service):
+                daemonHost.__reply(shared_container, service.response, ip, port)
+
+
+    def __syncToken(shared_container, service, sync_token):
+
+        if sync_token != None and sync_token != service.sync_token:
+            service.peer_seen = True
+
+        # Remember the other candidates, the lowest one succeeds a resigning master
+        if sync_token and sync_token != service.sync_token:
+            service.successors.add(sync_token)
+            if len(service.successors) > constants.MAX_SUCCESSORS * 2:
+                service.successors = set(sorted(service.successors)[:constants.MAX_SUCCESSORS])
+
+            # An election is going on, the master drops back to the base heartbeat
+            if service.sync_token == 0 and service.beacon_interval > shared_container.heartbeat_interval:
+                service.beacon_interval = shared_container.heartbeat_interval
+                daemonHost.__scheduleHeartbeat(shared_container, service, service.last_sync + shared_container.heartbeat_interval)
+
+        if sync_token == None:
+            service.master_candidate = True
+            service.read_own_it = 0
+
+        elif sync_token < service.sync_token:
+            service.master_candidate = False
+            service.read_own_it = 0
+            if sync_token == 0:
+                if service.master_seen == None:
+                    service.master_gap = shared_container.heartbeat_interval
+                    daemonHost.__scheduleCheck(shared_container, service, service.last_sync + daemonHost.__heartbeatTimeout(shared_container, service))
+
+                    # Let a new master know this backup can succeed it, only the lowest few bother
+                    if service.active and shared_container.run and sum(token < service.sync_token for token in service.successors) < constants.ANNOUNCE_SUCCESSORS:
+                        daemonHost.__beacon(shared_container, service)
+
+                    # Candidates heard so far belong to the finished election
+                    service.successors.clear()
+
+                # Replies to probes come off schedule, only regular gaps tell the master's pace
+                elif service.last_sync - service.master_seen >= shared_container.heartbeat_interval / 2:
+                    service.master_gap = service.last_sync - service.master_seen
+
+                service.master_seen = service.last_sync
+
+        elif sync_token == service.sync_token:
+
+            # Count one own read per send round, a takeover beacon may land next to a periodic one
+            if service.last_sync - service.last_own < shared_container.sync_send_time / 2:
+                return
+
+            service.last_own = service.last_sync
+            service.read_own_it += 1
+
+            if service.read_own_it >= shared_container.read_own_max_count and service.sync_token != 0:
+                daemonHost.__becomeMaster(shared_container, service)
+                service.successors.clear()
+
+        else:
+            service.read_own_it = 0
+
+
+    def __becomeMaster(shared_container, service):
+        service.sync_token = 0
+        service.master_since = shared_container.transport.monotonic()
+        service.elections_won += 1
+        service.beacon_interval = shared_container.heartbeat_interval
+        daemonHost.__scheduleHeartbeat(shared_container, service, service.master_since + shared_container.heartbeat_interval)
+
+
+    def __leaveMaster(shared_container, service):
+        service.sync_token = service.election.token()
+        if service.master_since != None:
+            service.master_time += shared_container.transport.monotonic() - service.master_since
+            service.master_since = None
+            service.masteries_lost += 1
+
+
+    def __resign(shared_container, service):
+        successor = min(service.successors) if service.successors else 0
+
+        if shared_container.binary_protocol:
+            shared_container.mcast_sync.send(binaryProtocol.pack(constants.BINARY_RESIGN, service.service_id, successor, service.port))
+        else:
+            shared_container.mcast_sync.send(service.encoded_name + constants.RESIGN_SEP + str(successor).encode())
+
+
+    def __resigned(shared_container, service, successor):
+
+        # Only backups following a master take part, a running election goes on undisturbed
+        service.peer_seen = True
+        service.successors.discard(successor)
+        if service.sync_token == 0 or service.master_seen == None:
+            return
+
+        # Pre-agreed successor takes over without a new election
+        if successor == service.sync_token and service.active:
+            daemonHost.__becomeMaster(shared_container, service)
+            service.master_candidate = True
+            service.read_own_it = 0
+            service.master_seen = None
+            daemonHost.__beacon(shared_container, service)
+
+        # Give the successor one heartbeat timeout to show up
+        elif successor:
+            service.master_candidate = False
+            service.master_seen = shared_container.transport.monotonic()
+            service.master_gap = shared_container.heartbeat_interval
+            daemonHost.__scheduleCheck(shared_container, service, service.master_seen + daemonHost.__heartbeatTimeout(shared_container, service))
+
+        else:
+            service.master_seen = None
+            daemonHost.__syncToken(shared_container, service, None)
+            if service.active:
+                daemonHost.__beacon(shared_container, service)
+
+
+    def __probe(shared_container, now, service, remaining):
+
+        if shared_container.services.get(service.encoded_name) is not service or not service.probing:
+            return
+
+        # Nobody answered the probe burst, a lone daemon needs no election
+        if remaining == 0:
+            service.probing = False
+            if not service.peer_seen and service.active and service.sync_token != 0:
+                daemonHost.__becomeMaster(shared_container, service)
+                service.master_candidate = True
+                service.successors.clear()
+                daemonHost.__beacon(shared_container, service)
+            return
+
+        if shared_container.binary_protocol:
+            shared_container.mcast_sync.send(binaryProtocol.pack(constants.BINARY_PROBE, service.service_id, service.sync_token, service.port))
+        else:
+            shared_container.mcast_sync.send(service.encoded_name + constants.PROBE_SEP + str(service.sync_token).encode())
+
+        daemonHost.__schedule(shared_container, now + shared_container.probe_time / shared_container.probe_count, daemonHost.__probe, service, remaining - 1)
+
+
+    def __probed(shared_container, service, sync_token):
+
+        if sync_token == service.sync_token:
+            return
+        service.peer_seen = True
+
+        # Masters and running candidates answer, backups leave it to their master
+        if service.active and (service.sync_token == 0 or service.master_seen == None):
+            daemonHost.__beacon(shared_container, service)
+
+
+    def __readSync(shared_container):
+
+        received_response, ip, port = shared_container.mcast_sync.read(0)
+        if not received_response:
+            return
+        shared_container.beacons_received += 1
+
+        binary_sync = binaryProtocol.unpack(received_response)
+        if binary_sync:
+            msg_type, service_id, sync_token, port = binary_sync
+            service = shared_container.services_by_id.get(service_id)
+            if msg_type == constants.BINARY_SYNC and service:
+                service.last_sync = shared_container.transport.monotonic()
+                daemonHost.__syncToken(shared_container, service, sync_token)
+            elif msg_type == constants.BINARY_RESIGN and service:
+                daemonHost.__resigned(shared_container, service, sync_token)
+            elif msg_type == constants.BINARY_PROBE and service:
+                daemonHost.__probed(shared_container, service, sync_token)
+            return
+
+        service_name, sep, sync_token = received_response.rpartition(constants.SYNC_SEP)
+        service = shared_container.services.get(service_name)
+        if service and sep and sync_token.isdigit():
+            service.last_sync = shared_container.transport.monotonic()
+            daemonHost.__syncToken(shared_container, service, int(sync_token))
+            return
+
+        service_name, sep, successor = received_response.rpartition(constants.RESIGN_SEP)
+        service = shared_container.services.get(service_name)
+        if service and sep and (successor.isdigit() or not successor):
+            daemonHost.__resigned(shared_container, service, int(successor) if successor else 0)
+            return
+
+        service_name, sep, sync_token = received_response.rpartition(constants.PROBE_SEP)
+        service = shared_container.services.get(service_name)
+        if service and sep and sync_token.isdigit():
+            daemonHost.__probed(shared_container, service, int(sync_token))
+
+
+    def __beacon(shared_container, service):
+        shared_container.beacons_sent += 1
+        if shared_container.binary_protocol:
+            shared_container.mcast_sync.send(binaryProtocol.pack(constants.BINARY_SYNC, service.service_id, service.sync_token, service.port))
+        else:
+            shared_container.mcast_sync.send(service.encoded_name + constants.SYNC_SEP + str(service.sync_token).encode())
+
+
+    def __sendSync(shared_container, now):
+
+        for service in shared_container.services.values():
+            if service.active and service.master_candidate and service.sync_token != 0:
+                daemonHost.__beacon(shared_container, service)
+
+        daemonHost.__schedule(shared_container, now + shared_container.sync_send_time, daemonHost.__sendSync)
+
+
+    def __scheduleHeartbeat(shared_container, service, when):
+        if service.heartbeat_at == None or when < service.heartbeat_at:
+            service.heartbeat_at = when
+            daemonHost.__schedule(shared_container, when, daemonHost.__sendHeartbeat, service, when)
+
+
+    def __sendHeartbeat(shared_container, now, service, when):
+
+        if shared_container.services.get(service.encoded_name) is not service or service.heartbeat_at != when:
+            return
+        service.heartbeat_at = None
+        if service.sync_token != 0:
+            return
+
+        if service.active and service.master_candidate:
+            daemonHost.__beacon(shared_container, service)
+
+        # Back off while nothing happens, each gap grows at most by the backoff factor
+        service.beacon_interval = min(service.beacon_interval * constants.HEARTBEAT_BACKOFF, shared_container.heartbeat_max_interval)
+        daemonHost.__scheduleHeartbeat(shared_container, service, now + service.beacon_interval)
+
+
+    def __heartbeatTimeout(shared_container, service):
+        interval = shared_container.heartbeat_interval
+        if shared_container.heartbeat_max_interval > interval:
+            interval = max(interval, min(service.master_gap * constants.HEARTBEAT_BACKOFF, shared_container.heartbeat_max_interval))
+        return interval * shared_container.heartbeat_miss_count
+
+
+    def __announce(shared_container, now, service):
+        if service.active:
+            daemonHost.__beacon(shared_container, service)
+
+
+    def __scheduleCheck(shared_container, service, when):
+        if service.check_at == None or when < service.check_at:
+            service.check_at = when
+            daemonHost.__schedule(shared_container, when, daemonHost.__checkSync, service, when)
+
+
+    def __checkSync(shared_container, now, service, when):
+
+        if shared_container.services.get(service.encoded_name) is not service or service.check_at != when:
+            return
+        service.check_at = None
+
+        # Master heartbeat lost, start the takeover right away
+        heartbeat_timeout = daemonHost.__heartbeatTimeout(shared_container, service)
+        if service.master_seen != None and now >= service.master_seen + heartbeat_timeout:
+            service.master_seen = None
+            daemonHost.__syncToken(shared_container, service, None)
+            if service.active:
+                daemonHost.__beacon(shared_container, service)
+
+        if service.master_seen != None:
+            deadline = service.master_seen + heartbeat_timeout
+
+        else:
+            # A service without sync traffic restarts its election
+            deadline = service.last_sync + shared_container.sync_read_time*2
+            if now >= deadline:
+                service.last_sync = now
+                daemonHost.__syncToken(shared_container, service, None)
+                deadline = now + shared_container.sync_read_time*2
+
+        daemonHost.__scheduleCheck(shared_container, service, deadline)
+
+
+    def __setActive(shared_container, service, active, resign=True):
+        if active and not service.active:
+            service.sync_token = service.election.token()
+            daemonHost.__schedule(shared_container, shared_container.transport.monotonic(), daemonHost.__announce, service)
+            daemonHost.__wakeup(shared_container)
+
+        elif service.active and not active and service.sync_token == 0:
+            service.active = False
+            daemonHost.__leaveMaster(shared_container, service)
+            if resign:
+                daemonHost.__resign(shared_container, service)
+
+        service.active = active
+
+
+    def __checkHealth(shared_container, now, service):
+        if shared_container.services.get(service.encoded_name) is not service:
+            return
+
+        # Probes may block, they run aside and report back to the engine
+        if not service.health_running:
+            service.health_running = True
+            shared_container.transport.spawn(daemonHost.__probeHealth, shared_container, service)
+        daemonHost.__schedule(shared_container, now + shared_container.health_interval, daemonHost.__checkHealth, service)
+
+
+    def __probeHealth(shared_container, service):
+        try:
+            healthy = service.health_check.healthy(service.port)
+
+        except Exception:
+            healthy = False
+
+        daemonHost.__schedule(shared_container, shared_container.transport.monotonic(), daemonHost.__healthResult, service, healthy)
+        daemonHost.__wakeup(shared_container)
+
+
+    def __healthResult(shared_container, now, service, healthy):
+        service.health_running = False
+        service.health_failures = 0 if healthy else service.health_failures + 1
+
+        # Step down after repeated failures so a healthy backup takes over, compete again once it recovers
+        if healthy and not service.healthy:
+            service.healthy = True
+            daemonHost.__setActive(shared_container, service, service.enable)
+
+        elif not healthy and service.healthy and service.health_failures >= shared_container.health_failures:
+            service.healthy = False
+            daemonHost.__setActive(shared_container, service, False)
+
+
+    def __deadline(shared_container):
+        with shared_container.timers_mutex:
+            return shared_container.timers[0][0] if shared_container.timers else None
+
+
+    # One engine thread serves every service, a failing callback must not take it down
+    def __call(shared_container, callback, *args):
+        try:
+            callback(shared_container, *args)
+
+        except Exception:
+            shared_container.callback_errors += 1
+
+
+    def __step(shared_container, timeout):
+
+        for key, events in shared_container.selector.select(timeout):
+            daemonHost.__call(shared_container, key.data)
+
+
+        # Fire expired timers
+        now = shared_container.transport.monotonic()
+        while shared_container.run:
+            with shared_container.timers_mutex:
+                if not shared_container.timers or shared_container.timers[0][0] > now:
+                    break
+                when, seq, callback, args = heapq.heappop(shared_container.timers)
+
+            daemonHost.__call(shared_container, callback, now, *args)
+
+
+    def register(self, service_name, port=None, election=None, weight=constants.WEIGHT, health_check=None):
+        service = container()
+        service.service_name = service_name
+        service.encoded_name = service_name.encode()
+        service.service_id = binaryProtocol.serviceId(service.encoded_name)
+        service.enable = True
+        service.healthy = True
+        service.active = True
+        service.health_check = callableHealthCheck(health_check) if health_check and not hasattr(health_check, "healthy") else health_check
+        service.health_failures = 0
+        service.health_running = False
+        service.port = port
+        service.weight = weight
+        daemonHost.__encodeResponse(service)
+        service.master_candidate = True
+        service.read_own_it = 0
+        service.last_sync = self.__shared_container.transport.monotonic()
+        service.master_seen = None
+        service.last_own = 0
+        service.check_at = None
+        service.successors = set()
+        service.peer_seen = False
+        service.master_since = None
+        service.master_time = 0
+        service.elections_won = 0
+        service.masteries_lost = 0
+        service.beacon_interval = self.__shared_container.heartbeat_interval
+        service.heartbeat_at = None
+        service.master_gap = self.__shared_container.heartbeat_interval
+        service.probing = self.__shared_container.cold_start_probe
+        service.election = election if election else randomElection(self.__shared_container.transport.random)
+        service.sync_token = service.election.token()
+
+        # Copy on write, the engine thread reads the dict without locking
+        with self.__shared_container.services_mutex:
+            services = dict(self.__shared_container.services)
+            services[service.encoded_name] = service
+            services_by_id = dict(self.__shared_container.services_by_id)
+            services_by_id[service.service_id] = service
+            self.__shared_container.services = services
+            self.__shared_container.services_by_id = services_by_id
+
+        # Announce once even if a master is already known, so it can name us as successor
+        daemonHost.__schedule(self.__shared_container, service.last_sync, daemonHost.__announce, service)
+        if service.probing:
+            daemonHost.__schedule(self.__shared_container, service.last_sync, daemonHost.__probe, service, self.__shared_container.probe_count)
+        daemonHost.__scheduleCheck(self.__shared_container, service, service.last_sync + self.__shared_container.sync_read_time*2)
+        if service.health_check:
+            daemonHost.__schedule(self.__shared_container, service.last_sync, daemonHost.__checkHealth, service)
+        daemonHost.__wakeup(self.__shared_container)
+
+
+    def unregister(self, service_name):
+        with self.__shared_container.services_mutex:
+            services = dict(self.__shared_container.services)
+            service = services.pop(service_name.encode(), None)
+            services_by_id = dict(self.__shared_container.services_by_id)
+            if service:
+                services_by_id.pop(service.service_id, None)
+            self.__shared_container.services = services
+            self.__shared_container.services_by_id = services_by_id
+
+        if service and service.sync_token == 0 and self.__thread:
+            daemonHost.__resign(self.__shared_container, service)
+
+
+    def services(self):
+        return [service.service_name for service in self.__shared_container.services.values()]
+
+
+    def stats(self):
+        now = self.__shared_container.transport.monotonic()
+        services = {}
+        for service in self.__shared_container.services.values():
+            services[service.service_name] = {
+                "master": service.sync_token == 0,
+                "healthy": service.healthy,
+                "health_failures": service.health_failures,
+                "master_time": service.master_time + (now - service.master_since if service.master_since != None else 0),
+                "elections_won": service.elections_won,
+                "masteries_lost": service.masteries_lost
+            }
+
+        return {
+            "requests_received": self.__shared_container.requests_received,
+            "requests_answered": self.__shared_container.requests_answered,
+            "requests_rate_limited": self.__shared_container.requests_rate_limited,
+            "requests_coalesced": self.__shared_container.requests_coalesced,
+            "callback_errors": self.__shared_container.callback_errors,
+            "beacons_sent": self.__shared_container.beacons_sent,
+            "beacons_received": self.__shared_container.beacons_received,
+            "services": services
+        }
+
+
+    def __prometheus(self):
+        stats = self.stats()
+        text = ""
+        for key in ("requests_received", "requests_answered", "requests_rate_limited", "requests_coalesced", "callback_errors", "beacons_sent", "beacons_received"):
+            text += metricsServer.sample("servicediscovery_daemon_%s_total" % key, stats[key])
+
+        for service_name, service in stats["services"].items():
+            labels = {"service": service_name}
+            text += metricsServer.sample("servicediscovery_daemon_master", service["master"], labels)
+            text += metricsServer.sample("servicediscovery_daemon_healthy", service["healthy"], labels)
+            text += metricsServer.sample("servicediscovery_daemon_master_seconds_total", float(service["master_time"]), labels)
+            text += metricsServer.sample("servicediscovery_daemon_elections_won_total", service["elections_won"], labels)
+            text += metricsServer.sample("servicediscovery_daemon_masteries_lost_total", service["masteries_lost"], labels)
+        return text
+
+
+    def metricsPort(self):
+        return self.__metrics.port() if self.__metrics else None
+
+
+    def run(self) -> threading.Thread:
+        self.__shared_container.request_prefix, self.__shared_container.request_suffix = [label.encode() for label in constants.DISCOVER_MSG_REQUEST.split(constants.SERVICE_LABEL)]
+        self.__shared_container.batch_request = constants.DISCOVER_MSG_BATCH_REQUEST.encode()
+        daemonHost.__schedule(self.__shared_container, self.__shared_container.transport.monotonic() + self.__shared_container.sync_send_time, daemonHost.__sendSync)
+
+        self.__thread = self.__shared_container.transport.start(daemonHost.__step, daemonHost.__deadline, self.__shared_container)
+        return self.__thread
+
+
+    # Without resign the backups only notice the missing heartbeats, as after a crash
+    def stop(self, resign=True):
+        running = self.__thread and self.__shared_container.run
+        self.__shared_container.run = False
+
+        if running and resign:
+            for service in self.__shared_container.services.values():
+                if service.sync_token == 0 and service.active:
+                    daemonHost.__leaveMaster(self.__shared_container, service)
+                    daemonHost.__resign(self.__shared_container, service)
+
+        daemonHost.__wakeup(self.__shared_container)
+        if self.__thread:
+            self.__thread.join()
+
+        if self.__metrics:
+            self.__metrics.close()
+            self.__metrics = None
+
+        self.__shared_container.selector.close()
+        self.__shared_container.mcast_listen_request.close()
+        self.__shared_container.mcast_sync.close()
+        self.__shared_container.reply_socket.close()
+        self.__shared_container.wakeup_rx.close()
+        self.__shared_container.wakeup_tx.close()
+
+
+    def getEnable(self, service_name):
+        return self.__service(service_name).enable
+
+
+    def setEnable(self, service_name, enable):
+        service = self.__service(service_name)
+        service.enable = enable
+        daemonHost.__setActive(self.__shared_container, service, enable and service.healthy, self.__thread != None)
+
+
+    def isHealthy(self, service_name):
+        return self.__service(service_name).healthy
+
+
+    def isMaster(self, service_name):
+        return self.__service(service_name).sync_token == 0
+
+
+    def setPort(self, service_name, port:int):
+        service = self.__service(service_name)
+        service.port = port
+        daemonHost.__encodeResponse(service)
+
+
+    def getPort(self, service_name) -> int:
+        return self.__service(service_name).port
+
+
+    def setWeight(self, service_name, weight:int):
+        service = self.__service(service_name)
+        service.weight = weight
+        daemonHost.__encodeResponse(service)
+
+
+    def getWeight(self, service_name) -> int:
+        return self.__service(service_name).weight
+
+
+class daemon():
+
+    def __init__(self, service_name, election=None, weight=constants.WEIGHT, health_check=None, **host_options):
+        self.__service_name = service_name
+        self.__host = daemonHost(**host_options)
+        self.__host.register(service_name, election=election, weight=weight, health_check=health_check)
+
+
+    def __del__(self):
+        self.stop()
+
+
+    def run(self) -> threading.Thread:
+        return self.__host.run()
+
+
+    def stop(self, resign=True):
+        self.__host.stop(resign)
+
+
+    def getEnable(self):
+        return self.__host.getEnable(self.__service_name)
+
+
+    def setEnable(self, enable):
+        self.__host.setEnable(self.__service_name, enable)
+
+
+    def isMaster(self):
+        return self.__host.isMaster(self.__service_name)
+
+
+    def isHealthy(self):
+        return self.__host.isHealthy(self.__service_name)
+
+
+    def setPort(self, port:int):
+        self.__host.setPort(self.__service_name, port)
+
+
+    def getPort(self) -> int:
+        return self.__host.getPort(self.__service_name)
+
+
+    def setWeight(self, weight:int):
+        self.__host.setWeight(self.__service_name, weight)
+
+
+    def getWeight(self) -> int:
+        return self.__host.getWeight(self.__service_name)
+
+
+    def stats(self):
+        stats = self.__host.stats()
+        stats.update(stats.pop("services")[self.__service_name])
+        return stats
+
+
+    def metricsPort(self):
+        return self.__host.metricsPort()
+
+
+class client():
+
+    # Lookups in flight are shared by every client in the process
+    __flights = singleFlight()
+
+
+    def __init__(self, cache_ttl=constants.CACHE_TTL, negative_cache_ttl=constants.NEGATIVE_CACHE_TTL, fast_lookup=constants.FAST_LOOKUP, persistent=constants.PERSISTENT, binary_protocol=constants.BINARY_PROTOCOL, metrics_port=constants.METRICS_PORT, balancer=None, resolver_path=constants.RESOLVER_PATH if constants.USE_RESOLVER else None, fault_injector=None, single_flight=constants.SINGLE_FLIGHT, transport=None):
+        self.__metrics = None
+        self.__shared_container = container()
+        self.__shared_container.transport = transport if transport else defaultTransport
+        self.__shared_container.fault_injector = fault_injector
+        self.__shared_container.resolver_path = resolver_path
+        self.__shared_container.balancer = balancer if balancer else roundRobinBalancer()
+        self.__shared_container.instances = {}
+        self.__shared_container.fast_lookup = fast_lookup
+        self.__shared_container.binary_protocol = binary_protocol
+        self.__shared_container.service_ids = {}
+        self.__shared_container.sequence = itertools.count(1)
+        self.__shared_container.watchers = {}
+        self.__shared_container.persistent = persistent
+        self.__shared_container.single_flight = single_flight
+        self.__shared_container.cache_ttl = cache_ttl
+        self.__shared_container.negative_cache_ttl = negative_cache_ttl
+        self.__shared_container.cache = {}
+        self.__shared_container.cache_mutex = threading.Lock()
+        self.__shared_container.open_mutex = threading.Lock()
+        self.__shared_container.waiters_mutex = threading.Lock()
+        self.__shared_container.response_waiters = {}
+        self.__shared_container.master_waiters = {}
+        self.__shared_container.last_sync = 0
+        self.__shared_container.thread = None
+        self.__shared_container.selector = None
+        self.__shared_container.mcast_sync = None
+        self.__shared_container.mcast_request = None
+        self.__shared_container.listener = None
+        self.__shared_container.run = True
+        self.__shared_container.stats_mutex = threading.Lock()
+        self.__shared_container.lookups = 0
+        self.__shared_container.lookup_timeouts = 0
+        self.__shared_container.cache_hits = 0
+        self.__shared_container.lookups_coalesced = 0
+        self.__shared_container.lookup_time = histogram()
+        self.__metrics = metricsServer(self.__prometheus, metrics_port) if metrics_port != None else None
+
+
+    def __del__(self):
+        self.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def __parseSync(shared_container, sync_msg):
+        binary_sync = binaryProtocol.unpack(sync_msg)
+        if binary_sync:
+            msg_type, service_id, token, port = binary_sync
+            if msg_type != constants.BINARY_SYNC:
+                return None, None, None
+            return shared_container.service_ids.get(service_id), token, port or None
+
+        name, sep, token = sync_msg.rpartition(constants.SYNC_SEP)
+        if not sep or not token.isdigit():
+            return None, None, None
+
+        try:
+            return name.decode(), int(token), None
+
+        except UnicodeDecodeError:
+            return None, None, None
+
+
+    def __readSync(shared_container):
+        received_response, ip, port = shared_container.mcast_sync.read(0)
+        if not received_response:
+            return
+
+        shared_container.last_sync = shared_container.transport.monotonic()
+        service_name, token, service_port = client.__parseSync(shared_container, received_response)
+        if token == None:
+            client.__readResign(shared_container, received_response, ip)
+            return
+
+        elif token != 0:
+            return
+
+        watch = shared_container.watchers.get(service_name)
+        if watch:
+            client.__masterSeen(shared_container, watch, ip, service_port)
+
+        # Drop entries that no longer point to the current master, binary beacons also carry its port
+        with shared_container.cache_mutex:
+            entry = shared_container.cache.get(service_name)
+            if entry and (entry[0] != ip or (service_port is not None and entry[1] != service_port)):
+                del shared_container.cache[service_name]
+
+        with shared_container.waiters_mutex:
+            waiters = shared_container.master_waiters.pop(service_name, [])
+        for waiter in waiters:
+            waiter.event.set()
+
+
+    def __readResign(shared_container, received_response, ip):
+        binary_resign = binaryProtocol.unpack(received_response)
+        if binary_resign:
+            msg_type, service_id, successor, port = binary_resign
+            service_name = shared_container.service_ids.get(service_id) if msg_type == constants.BINARY_RESIGN else None
+
+        else:
+            service_name, sep, successor = received_response.rpartition(constants.RESIGN_SEP)
+            service_name = service_name.decode(errors="replace") if sep and (successor.isdigit() or not successor) else None
+
+        with shared_container.cache_mutex:
+            shared_container.cache.pop(service_name, None)
+
+        # The watched master steps down, report it now instead of after the heartbeat timeout
+        watch = shared_container.watchers.get(service_name)
+        if watch and watch.ip in (ip, None):
+            watch.ip = None
+            watch.port = None
+            client.__notify(shared_container, watch, None, None)
+
+
+    def __readResponse(shared_container):
+        received_response, ip, port = shared_container.listener.read(0)
+        if not received_response:
+            return
+
+        service_name, service_port = client.__parseResponse(shared_container, received_response)
+        with shared_container.waiters_mutex:
+            waiters = shared_container.response_waiters.pop(service_name, [])
+        for waiter in waiters:
+            waiter.results[service_name] = (ip, service_port)
+            waiter.event.set()
+
+
+    def __wakeup(shared_container):
+        try:
+            shared_container.wakeup_tx.send(b'\0')
+
+        except socket.error:
+            pass
+
+
+    def __readWakeup(shared_container):
+        try:
+            shared_container.wakeup_rx.recv(4096)
+
+        except socket.error:
+            pass
+
+
+    def __notify(shared_container, watch, ip, port):
+        for callback in list(watch.callbacks):
+            try:
+                callback(watch.service_name, ip, port)
+
+            except Exception:
+                pass
+
+
+    def __resolveMaster(shared_container, watch, ip, port=None):
+        # Straight to multicast, a resolver asking itself would get its own stale entry back
+        resolver = client(fast_lookup=True, binary_protocol=shared_container.binary_protocol, resolver_path=None, transport=shared_container.transport)
+        resolved_ip, resolved_port = resolver.getServiceIPAndPort(watch.service_name)
+        resolver.close()
+
+        # Skip results overtaken by a newer master change, a recheck only reports a new port
+        if watch.ip == ip and watch.port == port and shared_container.run and (port is None or resolved_port not in (None, port)):
+            watch.port = resolved_port
+            client.__notify(shared_container, watch, resolved_ip or ip, resolved_port)
+
+
+    def __masterSeen(shared_container, watch, ip, port):
+        now = shared_container.transport.monotonic()
+        resumed = False
+        if watch.ip == ip:
+            resumed = now - watch.last_seen >= watch.gap * 2
+            watch.gap = now - watch.last_seen
+        watch.last_seen = now
+        if watch.ip == ip and (port is None or watch.port == port):
+
+            # Beacons missing for a while, another daemon on the same host may have taken over
+            if resumed and port is None and watch.port is not None:
+                shared_container.transport.spawn(client.__resolveMaster, shared_container, watch, ip, watch.port)
+            return
+
+        watch.ip = ip
+        watch.port = port
+        if port is not None:
+            client.__notify(shared_container, watch, ip, port)
+        else:
+            shared_container.transport.spawn(client.__resolveMaster, shared_container, watch, ip)
+
+
+    def __checkWatchers(shared_container):
+        now = shared_container.transport.monotonic()
+        for watch in list(shared_container.watchers.values()):
+            if watch.ip and now - watch.last_seen >= max(constants.MCAST_SYNC_READ_TIME*2, watch.gap * constants.HEARTBEAT_BACKOFF * 2):
+                watch.ip = None
+                watch.port = None
+                client.__notify(shared_container, watch, None, None)
+
+
+    def __deadline(shared_container):
+        return shared_container.transport.monotonic() + constants.MCAST_SYNC_READ_TIME if shared_container.watchers else None
+
+
+    def __step(shared_container, timeout):
+        for key, events in shared_container.selector.select(timeout):
+            try:
+                key.data(shared_container)
+
+            except Exception:
+                pass
+
+        if shared_container.watchers:
+            client.__checkWatchers(shared_container)
+
+
+    def __open(self):
+        with self.__shared_container.open_mutex:
+            if self.__shared_container.thread or not self.__shared_container.run:
+                return self.__shared_container.run
+
+            transport = self.__shared_container.transport
+            self.__shared_container.selector = transport.selector()
+            self.__shared_container.wakeup_rx, self.__shared_container.wakeup_tx = transport.socketpair()
+            self.__shared_container.selector.register(self.__shared_container.wakeup_rx, selectors.EVENT_READ, client.__readWakeup)
+
+            self.__shared_container.mcast_sync = transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SYNC_PORT)
+            self.__shared_container.selector.register(self.__shared_container.mcast_sync, selectors.EVENT_READ, client.__readSync)
+
+            if self.__shared_container.persistent:
+                self.__shared_container.mcast_request = self.__faulty(transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT))
+                self.__shared_container.listener = self.__faulty(transport.listener())
+                self.__shared_container.selector.register(self.__shared_container.listener, selectors.EVENT_READ, client.__readResponse)
+
+            self.__shared_container.thread = transport.start(client.__step, client.__deadline, self.__shared_container)
+            return True
+
+
+    # Lookup requests and replies go through the fault injector when testing lossy networks
+    def __faulty(self, sock):
+        fault_injector = self.__shared_container.fault_injector
+        return fault_injector.wrap(sock, self.__shared_container.transport.monotonic) if fault_injector else sock
+
+
+    def __retrySchedule(self, timeout):
+        return retrySchedule(timeout, clock=self.__shared_container.transport.monotonic, rng=self.__shared_container.transport.random)
+
+
+    def __waiter(self, waiters, service_names):
+        waiter = container()
+        waiter.event = threading.Event()
+        waiter.results = {}
+        with self.__shared_container.waiters_mutex:
+            for service_name in service_names:
+                waiters.setdefault(service_name, []).append(waiter)
+        return waiter
+
+
+    def __dropWaiter(self, waiters, waiter):
+        with self.__shared_container.waiters_mutex:
+            for service_name in list(waiters):
+                if waiter in waiters[service_name]:
+                    waiters[service_name].remove(waiter)
+                    if not waiters[service_name]:
+                        del waiters[service_name]
+
+
+    def __getCached(self, service_name):
+        with self.__shared_container.cache_mutex:
+            entry = self.__shared_container.cache.get(service_name)
+            if not entry:
+                return None
+
+            if self.__shared_container.transport.monotonic() >= entry[2]:
+                del self.__shared_container.cache[service_name]
+                return None
+
+            return entry
+
+
+    def __setCached(self, service_name, ip, port):
+        ttl = self.__shared_container.cache_ttl if ip else self.__shared_container.negative_cache_ttl
+        if ttl <= 0 or not self.__open():
+            return
+
+        with self.__shared_container.cache_mutex:
+            self.__shared_container.cache[service_name] = (ip, port, self.__shared_container.transport.monotonic() + ttl)
+
+
+    # Each lookup carries its own sequence, daemons only coalesce retransmissions of the same lookup
+    def __request(self, service_name, listen_port):
+        service_id = binaryProtocol.serviceId(service_name)
+        self.__shared_container.service_ids[service_id] = service_name
+        sequence = next(self.__shared_container.sequence)
+        if self.__shared_container.binary_protocol:
+            return binaryProtocol.pack(constants.BINARY_REQUEST, service_id, sequence, listen_port)
+
+        return constants.DISCOVER_MSG_REQUEST.replace(constants.SERVICE_LABEL, service_name).encode() + constants.PORT_SEP + str(listen_port).encode() + constants.PORT_SEP + str(sequence).encode()
+
+
+    def __readServiceResponse(self, listen_respose, service_name, timeout):
+        received_response, ip, port = listen_respose.read(timeout)
+
+        if received_response:
+            response_name, response_port = client.__parseResponse(self.__shared_container, received_response)
+            if response_name == service_name:
+                return True, ip, response_port
+
+        return False, None, None
+
+
+    def __exchange(self, mcast_send_request, listen_respose, request, service_name, timeout):
+        schedule = self.__retrySchedule(timeout)
+        resend_time = schedule.next()
+        while resend_time:
+            mcast_send_request.send(request)
+            while True:
+                valid, ip, port = self.__readServiceResponse(listen_respose, service_name, max(0, resend_time - self.__shared_container.transport.monotonic()))
+                if valid:
+                    return True, ip, port
+
+                elif self.__shared_container.transport.monotonic() >= resend_time:
+                    break
+
+            resend_time = schedule.next()
+
+        return False, None, None
+
+
+    def __isMasterSync(self, sync_msg, service_name):
+        sync_name, token, port = client.__parseSync(self.__shared_container, sync_msg)
+        return sync_name == service_name and token == 0
+
+
+    def __getServiceIP(self, service_name, timeout=5, retry=0) -> str:
+        mcast_send_request = self.__faulty(self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT))
+        listen_respose = self.__faulty(self.__shared_container.transport.listener())
+
+        request = self.__request(service_name, listen_respose.port)
+
+        i = 0
+
+
+        # Fast path, only the master answers so the first valid reply is enough
+        if self.__shared_container.fast_lookup:
+            valid, ip, port = self.__exchange(mcast_send_request, listen_respose, request, service_name, constants.FAST_LOOKUP_TIME)
+            if valid:
+                return ip, port
+
+
+        sync_listener = self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SYNC_PORT)
+
+
+        # Wait sync end
+        start_time = self.__shared_container.transport.monotonic()
+        while True:
+            received_response, ip, port = sync_listener.read(constants.MCAST_SYNC_READ_TIME*2)
+
+            if not received_response:
+                return None, None
+
+            elif self.__isMasterSync(received_response, service_name):
+                break
+
+            elif self.__shared_container.transport.monotonic() - start_time > timeout:
+                return None, None
+
+
+        # Send request, a lost packet costs a short retransmit instead of the whole timeout
+        while retry < 0 or i <= retry:
+
+            valid, ip, port = self.__exchange(mcast_send_request, listen_respose, request, service_name, timeout)
+            if valid:
+                return ip, port
+
+            i += 1
+
+        return None, None
+
+
+    def __requestShared(self, service_name, request, timeout):
+        waiter = self.__waiter(self.__shared_container.response_waiters, [service_name])
+        try:
+            schedule = self.__retrySchedule(timeout)
+            resend_time = schedule.next()
+            while resend_time:
+                self.__shared_container.mcast_request.send(request)
+                if self.__shared_container.transport.wait(waiter.event, max(0, resend_time - self.__shared_container.transport.monotonic())):
+                    return waiter.results[service_name]
+                resend_time = schedule.next()
+            return None
+
+        finally:
+            self.__dropWaiter(self.__shared_container.response_waiters, waiter)
+
+
+    def __getServiceIPShared(self, service_name, timeout=5, retry=0):
+        if not self.__open():
+            return None, None
+
+        request = self.__request(service_name, self.__shared_container.listener.port)
+
+        i = 0
+
+
+        # Fast path, only the master answers so the first valid reply is enough
+        if self.__shared_container.fast_lookup:
+            result = self.__requestShared(service_name, request, constants.FAST_LOOKUP_TIME)
+            if result:
+                return result
+
+
+        # Wait sync end
+        start_time = self.__shared_container.transport.monotonic()
+        while True:
+            waiter = self.__waiter(self.__shared_container.master_waiters, [service_name])
+            try:
+                if self.__shared_container.transport.wait(waiter.event, constants.MCAST_SYNC_READ_TIME):
+                    break
+
+            finally:
+                self.__dropWaiter(self.__shared_container.master_waiters, waiter)
+
+            now = self.__shared_container.transport.monotonic()
+            if now - max(start_time, self.__shared_container.last_sync) >= constants.MCAST_SYNC_READ_TIME*2:
+                return None, None
+
+            elif now - start_time > timeout:
+                return None, None
+
+
+        # Send request
+        while retry < 0 or i <= retry:
+
+            result = self.__requestShared(service_name, request, timeout)
+            if result:
+                return result
+
+            i += 1
+
+        return None, None
+
+
+    def __parseResponse(shared_container, received_response):
+        binary_response = binaryProtocol.unpack(received_response)
+        if binary_response:
+            msg_type, service_id, token, port = binary_response
+            if msg_type != constants.BINARY_RESPONSE:
+                return None, None
+            return shared_container.service_ids.get(service_id), port or None
+
+        prefix, suffix = [label.encode() for label in constants.DISCOVER_MSG_RESPONSE.split(constants.SERVICE_LABEL)]
+        response_split = received_response.split(constants.PORT_SEP)
+        label = response_split[0]
+        if not label.startswith(prefix) or not label.endswith(suffix):
+            return None, None
+
+        try:
+            service_name = label[len(prefix):len(label) - len(suffix)].decode()
+            return service_name, int(response_split[1]) if len(response_split) > 1 else None
+
+        except:
+            return None, None
+
+
+    def __batchRequests(listen_port, service_names):
+        header = constants.DISCOVER_MSG_BATCH_REQUEST.encode() + constants.PORT_SEP + str(listen_port).encode()
+
+        requests = []
+        request = header
+        for service_name in service_names:
+            encoded_name = constants.PORT_SEP + service_name.encode()
+            if request != header and len(request) + len(encoded_name) > constants.MTU:
+                requests.append(request)
+                request = header
+            request += encoded_name
+
+        requests.append(request)
+        return requests
+
+
+    def __getServices(self, service_names, timeout):
+        mcast_send_request = self.__faulty(self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT))
+        listen_respose = self.__faulty(self.__shared_container.transport.listener())
+
+        results = {}
+        pending = set(service_names)
+        schedule = self.__retrySchedule(timeout)
+        resend_time = schedule.next()
+        while pending and resend_time:
+
+            # Ask again only for the names still missing
+            for request in client.__batchRequests(listen_respose.port, sorted(pending)):
+                mcast_send_request.send(request)
+
+            while pending and self.__shared_container.transport.monotonic() < resend_time:
+                received_response, ip, port = listen_respose.read(max(0, resend_time - self.__shared_container.transport.monotonic()))
+                if not received_response:
+                    break
+
+                service_name, service_port = client.__parseResponse(self.__shared_container, received_response)
+                if service_name in pending:
+                    pending.discard(service_name)
+                    results[service_name] = (ip, service_port)
+
+            resend_time = schedule.next()
+
+        return results
+
+
+    def __getServicesShared(self, service_names, timeout):
+        if not self.__open():
+            return {}
+
+        waiter = self.__waiter(self.__shared_container.response_waiters, service_names)
+        try:
+            pending = set(service_names)
+            schedule = self.__retrySchedule(timeout)
+            resend_time = schedule.next()
+            while pending and resend_time:
+
+                # Ask again only for the names still missing
+                for request in client.__batchRequests(self.__shared_container.listener.port, sorted(pending)):
+                    self.__shared_container.mcast_request.send(request)
+
+                while pending and self.__shared_container.transport.monotonic() < resend_time:
+                    self.__shared_container.transport.wait(waiter.event, max(0, resend_time - self.__shared_container.transport.monotonic()))
+                    waiter.event.clear()
+                    pending.difference_update(waiter.results)
+
+                resend_time = schedule.next()
+
+            return dict(waiter.results)
+
+        finally:
+            self.__dropWaiter(self.__shared_container.response_waiters, waiter)
+
+
+    def __count(self, lookups, timeouts, cache_hits, elapsed, coalesced=0):
+        with self.__shared_container.stats_mutex:
+            self.__shared_container.lookups += lookups
+            self.__shared_container.lookup_timeouts += timeouts
+            self.__shared_container.cache_hits += cache_hits
+            self.__shared_container.lookups_coalesced += coalesced
+        for i in range(lookups):
+            self.__shared_container.lookup_time.observe(elapsed)
+
+
+    def __askResolver(self, service_name, timeout):
+        resolver_path = self.__shared_container.resolver_path
+        if not resolver_path or not self.__shared_container.transport.local_resolver:
+            return False, None, None
+
+        # Only trust a resolver socket bound by this user or root
+        try:
+            status = os.stat(resolver_path)
+
+        except OSError:
+            return False, None, None
+
+        if not stat.S_ISSOCK(status.st_mode) or status.st_uid not in (0, os.getuid()):
+            return False, None, None
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            sock.bind("")
+            sock.settimeout(timeout + constants.RESOLVER_MARGIN_TIME)
+            sock.sendto(service_name.encode() + constants.PORT_SEP + str(timeout).encode(), resolver_path)
+            while True:
+                response_name, ip, port = sock.recv(constants.MTU).rsplit(constants.PORT_SEP, 2)
+                if response_name == service_name.encode():
+                    return True, ip.decode() or None, int(port) if port else None
+
+        # No resolver listening or no answer in time, multicast does the job
+        except (OSError, ValueError):
+            return False, None, None
+
+        finally:
+            sock.close()
+
+
+    def __lookup(self, service_name, timeout, retry):
+        start_time = self.__shared_container.transport.monotonic()
+        entry = self.__getCached(service_name)
+        if entry:
+            self.__count(1, 0, 1, self.__shared_container.transport.monotonic() - start_time)
+            return entry[0], entry[1]
+
+        # Concurrent lookups of the same name ride on a single network exchange
+        key = (service_name, self.__shared_container.binary_protocol, self.__shared_container.resolver_path, self.__shared_container.transport)
+        deadline = None if retry < 0 else start_time + timeout * (retry + 2)
+        while True:
+            flight, leader = client.__flights.join(key) if self.__shared_container.single_flight else (None, True)
+            if leader:
+                break
+
+            result = client.__flights.wait(flight, None if deadline == None else max(0, deadline - self.__shared_container.transport.monotonic()))
+            ip, port = result if result else (None, None)
+
+            # A leader with a shorter budget gave up, the follower keeps trying with its own
+            if ip != None or (deadline != None and self.__shared_container.transport.monotonic() >= deadline):
+                self.__setCached(service_name, ip, port)
+                self.__count(1, ip == None, 0, self.__shared_container.transport.monotonic() - start_time, 1)
+                return ip, port
+
+        ip, port = None, None
+        try:
+            resolved, ip, port = self.__askResolver(service_name, timeout)
+
+            # The resolver only tried once, the remaining attempts go over multicast
+            if resolved and ip == None and retry != 0:
+                resolved = False
+                retry = retry - 1 if retry > 0 else retry
+
+            if not resolved and self.__shared_container.persistent:
+                ip, port = self.__getServiceIPShared(service_name, timeout, retry)
+            elif not resolved:
+                ip, port = self.__getServiceIP(service_name, timeout, retry)
+
+        finally:
+            if flight != None:
+                client.__flights.land(key, flight, (ip, port))
+
+        self.__setCached(service_name, ip, port)
+        self.__count(1, ip == None, 0, self.__shared_container.transport.monotonic() - start_time)
+        return ip, port
+
+
+    def getServiceIP(self, service_name, timeout=5, retry=0):
+        ip, metadata = self.__lookup(service_name, timeout, retry)
+        return ip
+
+
+    def getServiceIPAndPort(self, service_name, timeout=5, retry=0):
+        ip, port = self.__lookup(service_name, timeout, retry)
+        return ip, port
+
+
+    def __parseInstance(shared_container, received_response):
+        binary_response = binaryProtocol.unpack(received_response)
+        if binary_response:
+            msg_type, service_id, weight, port = binary_response
+            if msg_type != constants.BINARY_INSTANCE:
+                return None, None, None
+            return shared_container.service_ids.get(service_id), port or None, weight
+
+        prefix, suffix = [label.encode() for label in constants.DISCOVER_MSG_RESPONSE.split(constants.SERVICE_LABEL)]
+        response_split = received_response.split(constants.PORT_SEP)
+        label = response_split[0]
+        if len(response_split) != 3 or not label.startswith(prefix) or not label.endswith(suffix):
+            return None, None, None
+
+        try:
+            service_name = label[len(prefix):len(label) - len(suffix)].decode()
+            return service_name, int(response_split[1]) if response_split[1] else None, int(response_split[2])
+
+        except:
+            return None, None, None
+
+
+    def __getInstances(self, service_name, timeout):
+        mcast_send_request = self.__faulty(self.__shared_container.transport.mcast(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT))
+        listen_respose = self.__faulty(self.__shared_container.transport.listener())
+
+        service_id = binaryProtocol.serviceId(service_name)
+        self.__shared_container.service_ids[service_id] = service_name
+        if self.__shared_container.binary_protocol:
+            mcast_send_request.send(binaryProtocol.pack(constants.BINARY_INSTANCES_REQUEST, service_id, 0, listen_respose.port))
+        else:
+            mcast_send_request.send(constants.DISCOVER_MSG_REQUEST.replace(constants.SERVICE_LABEL, service_name).encode() + constants.PORT_SEP + str(listen_respose.port).encode() + constants.PORT_SEP + constants.DISCOVER_MSG_INSTANCES_LABEL)
+
+        # Every live instance answers once, collect them for the whole timeout
+        instances = {}
+        deadline = self.__shared_container.transport.monotonic() + timeout
+        while self.__shared_container.transport.monotonic() < deadline:
+            received_response, ip, port = listen_respose.read(max(0, deadline - self.__shared_container.transport.monotonic()))
+            if not received_response:
+                break
+
+            response_name, response_port, weight = client.__parseInstance(self.__shared_container, received_response)
+            if response_name == service_name:
+                instances[(ip, response_port)] = weight
+
+        return sorted((ip, port, weight) for (ip, port), weight in instances.items())
+
+
+    def getServiceInstances(self, service_name, timeout=constants.INSTANCES_TIME):
+        start_time = self.__shared_container.transport.monotonic()
+        with self.__shared_container.cache_mutex:
+            entry = self.__shared_container.instances.get(service_name)
+        if entry and self.__shared_container.transport.monotonic() < entry[1]:
+            self.__count(1, 0, 1, self.__shared_container.transport.monotonic() - start_time)
+            return list(entry[0])
+
+        instances = self.__getInstances(service_name, timeout)
+        ttl = self.__shared_container.cache_ttl if instances else self.__shared_container.negative_cache_ttl
+        if ttl > 0:
+            with self.__shared_container.cache_mutex:
+                self.__shared_container.instances[service_name] = (instances, self.__shared_container.transport.monotonic() + ttl)
+
+        self.__count(1, not instances, 0, self.__shared_container.transport.monotonic() - start_time)
+        return list(instances)
+
+
+    def getServiceInstance(self, service_name, timeout=constants.INSTANCES_TIME):
+        instances = [instance for instance in self.getServiceInstances(service_name, timeout) if instance[2] > 0]
+        if not instances:
+            return None, None
+
+        ip, port, weight = self.__shared_container.balancer.select(service_name, instances)
+        return ip, port
+
+
+    def getServices(self, service_names, timeout=5):
+        start_time = self.__shared_container.transport.monotonic()
+        results = {}
+        missing = []
+        for service_name in dict.fromkeys(service_names):
+            entry = self.__getCached(service_name)
+            if entry:
+                results[service_name] = (entry[0], entry[1])
+            else:
+                missing.append(service_name)
+        self.__count(len(results), 0, len(results), self.__shared_container.transport.monotonic() - start_time)
+
+        if missing:
+            if self.__shared_container.persistent:
+                resolved = self.__getServicesShared(missing, timeout)
+            else:
+                resolved = self.__getServices(missing, timeout)
+
+            for service_name in missing:
+                ip, port = resolved.get(service_name, (None, None))
+                self.__setCached(service_name, ip, port)
+                results[service_name] = (ip, port)
+            self.__count(len(missing), sum(results[service_name][0] == None for service_name in missing), 0, self.__shared_container.transport.monotonic() - start_time)
+
+        return results
+
+
+    def watch(self, service_name, callback):
+        if not self.__open():
+            return False
+
+        with self.__shared_container.waiters_mutex:
+            watchers = dict(self.__shared_container.watchers)
+            watch = watchers.get(service_name)
+            if not watch:
+                watch = container()
+                watch.service_name = service_name
+                watch.callbacks = []
+                watch.ip = None
+                watch.port = None
+                watch.last_seen = 0
+                watch.gap = 0
+                watchers[service_name] = watch
+            watch.callbacks.append(callback)
+
+            self.__shared_container.service_ids[binaryProtocol.serviceId(service_name)] = service_name
+            self.__shared_container.watchers = watchers
+
+        client.__wakeup(self.__shared_container)
+        return True
+
+
+    def unwatch(self, service_name, callback=None):
+        with self.__shared_container.waiters_mutex:
+            watchers = dict(self.__shared_container.watchers)
+            watch = watchers.get(service_name)
+            if not watch:
+                return
+
+            if callback and callback in watch.callbacks:
+                watch.callbacks.remove(callback)
+
+            if not callback or not watch.callbacks:
+                del watchers[service_name]
+            self.__shared_container.watchers = watchers
+
+
+    def invalidate(self, service_name=None):
+        with self.__shared_container.cache_mutex:
+            if service_name is None:
+                self.__shared_container.cache.clear()
+                self.__shared_container.instances.clear()
+            else:
+                self.__shared_container.cache.pop(service_name, None)
+                self.__shared_container.instances.pop(service_name, None)
+
+
+    def stats(self):
+        with self.__shared_container.stats_mutex:
+            return {
+                "lookups": self.__shared_container.lookups,
+                "lookup_timeouts": self.__shared_container.lookup_timeouts,
+                "cache_hits": self.__shared_container.cache_hits,
+                "lookups_coalesced": self.__shared_container.lookups_coalesced,
+                "lookup_time": self.__shared_container.lookup_time.snapshot()
+            }
+
+
+    def __prometheus(self):
+        stats = self.stats()
+        text = ""
+        for key in ("lookups", "lookup_timeouts", "cache_hits", "lookups_coalesced"):
+            text += metricsServer.sample("servicediscovery_client_%s_total" % key, stats[key])
+        text += metricsServer.histogramSamples("servicediscovery_client_lookup_seconds", stats["lookup_time"])
+        return text
+
+
+    def metricsPort(self):
+        return self.__metrics.port() if self.__metrics else None
+
+
+    def close(self):
+        if self.__metrics:
+            self.__metrics.close()
+            self.__metrics = None
+
+        with self.__shared_container.open_mutex:
+            self.__shared_container.run = False
+            if not self.__shared_container.thread:
+                return
+
+            client.__wakeup(self.__shared_container)
+            self.__shared_container.thread.join()
+            self.__shared_container.thread = None
+
+            self.__shared_container.selector.close()
+            self.__shared_container.wakeup_rx.close()
+            self.__shared_container.wakeup_tx.close()
+            self.__shared_container.mcast_sync.close()
+            if self.__shared_container.persistent:
+                self.__shared_container.mcast_request.close()
+                self.__shared_container.listener.close()
+
+
+class resolver():
+
+    def __init__(self, path=constants.RESOLVER_PATH, binary_protocol=constants.BINARY_PROTOCOL):
+        self.__thread = None
+        self.__shared_container = container()
+        self.__shared_container.run = False
+        resolver.__claimPath(path)
+
+        self.__shared_container.run = True
+        self.__shared_container.path = path
+        self.__shared_container.masters = {}
+        self.__shared_container.pending = {}
+        self.__shared_container.watched = set()
+        self.__shared_container.mutex = threading.Lock()
+
+        # One persistent client per host watches the sync group for everyone
+        self.__shared_container.client = client(fast_lookup=True, persistent=True, binary_protocol=binary_protocol, resolver_path=None)
+
+        self.__shared_container.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.__shared_container.socket.bind(path)
+        self.__shared_container.wakeup_rx, self.__shared_container.wakeup_tx = socket.socketpair()
+        self.__shared_container.selector = selectors.DefaultSelector()
+        self.__shared_container.selector.register(self.__shared_container.socket, selectors.EVENT_READ, resolver.__readQuery)
+        self.__shared_container.selector.register(self.__shared_container.wakeup_rx, selectors.EVENT_READ, None)
+
+
+    def __del__(self):
+        self.stop()
+
+
+    # Only a stale socket left by a dead resolver is replaced, never a live one or another file
+    def __claimPath(path):
+        try:
+            status = os.lstat(path)
+
+        except FileNotFoundError:
+            return
+
+        if not stat.S_ISSOCK(status.st_mode):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            probe.connect(path)
+
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+
+        finally:
+            probe.close()
+
+        raise OSError(errno.EADDRINUSE, os.strerror(errno.EADDRINUSE), path)
+
+
+    def __reply(shared_container, service_name, ip, port, addresses):
+        response = service_name.encode() + constants.PORT_SEP + (ip or "").encode() + constants.PORT_SEP + (str(port).encode() if port else b'')
+        for address in addresses:
+            try:
+                shared_container.socket.sendto(response, address)
+
+            except OSError:
+                pass
+
+
+    def __masterChanged(shared_container, service_name, ip, port):
+        with shared_container.mutex:
+            if ip:
+                shared_container.masters[service_name] = (ip, port)
+            else:
+                shared_container.masters.pop(service_name, None)
+
+
+    def __resolve(shared_container, service_name, timeout):
+        ip, port = shared_container.client.getServiceIPAndPort(service_name, timeout)
+
+        with shared_container.mutex:
+            if ip:
+                shared_container.masters[service_name] = (ip, port)
+            addresses = shared_container.pending.pop(service_name, [])
+            watch = ip and service_name not in shared_container.watched
+            if watch:
+                shared_container.watched.add(service_name)
+
+        # Keep the entry current from the sync group from now on, one watch outlives master changes
+        if watch:
+            shared_container.client.watch(service_name, lambda name, ip, port: resolver.__masterChanged(shared_container, name, ip, port))
+        resolver.__reply(shared_container, service_name, ip, port, addresses)
+
+
+    def __readQuery(shared_container):
+        try:
+            query, address = shared_container.socket.recvfrom(constants.MTU)
+            service_name, sep, timeout = query.rpartition(constants.PORT_SEP)
+            service_name = service_name.decode()
+            timeout = float(timeout)
+
+        except (OSError, ValueError):
+            return
+
+        with shared_container.mutex:
+            master = shared_container.masters.get(service_name)
+            if not master:
+                addresses = shared_container.pending.setdefault(service_name, [])
+                addresses.append(address)
+
+        if master:
+            resolver.__reply(shared_container, service_name, master[0], master[1], [address])
+
+        # Unknown service, a single lookup answers every query waiting for it
+        elif len(addresses) == 1:
+            threading.Thread(target=resolver.__resolve, daemon=True, args=[shared_container, service_name, timeout]).start()
+
+
+    def __run(shared_container):
+        while shared_container.run:
+            for key, events in shared_container.selector.select():
+                if key.data:
+                    key.data(shared_container)
+
+
+    def run(self) -> threading.Thread:
+        self.__thread = threading.Thread(target=resolver.__run, daemon=True, args=[self.__shared_container])
+        self.__thread.start()
+        return self.__thread
+
+
+    def stop(self):
+        if not self.__shared_container.run:
+            return
+        self.__shared_container.run = False
+
+        self.__shared_container.wakeup_tx.send(b'\0')
+        if self.__thread:
+            self.__thread.join()
+
+        self.__shared_container.selector.close()
+        self.__shared_container.socket.close()
+        self.__shared_container.wakeup_rx.close()
+        self.__shared_container.wakeup_tx.close()
+        self.__shared_container.client.close()
+        if os.path.exists(self.__shared_container.path):
+            os.unlink(self.__shared_container.path)
+
+
+    def services(self):
+        with self.__shared_container.mutex:
+            return dict(self.__shared_container.masters)
+
+
+class asyncResponseProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, waiters):
+        super().__init__()
+        self.__waiters = waiters
+        self.__prefix, self.__suffix = [label.encode() for label in constants.DISCOVER_MSG_RESPONSE.split(constants.SERVICE_LABEL)]
+
+
+    def datagram_received(self, data, addr):
+        response_split = data.split(constants.PORT_SEP)
+        label = response_split[0]
+        if not label.startswith(self.__prefix) or not label.endswith(self.__suffix):
+            return
+
+        try:
+            service_name = label[len(self.__prefix):len(label) - len(self.__suffix)].decode()
+            port = int(response_split[1]) if len(response_split) > 1 else None
+
+        except:
+            return
+
+        for future in self.__waiters.pop(service_name, []):
+            if not future.done():
+                future.set_result((addr[0], port))
+
+
+class asyncClient():
+
+    def __init__(self):
+        self.__waiters = {}
+        self.__request_transport = None
+        self.__response_transport = None
+        self.__open_lock = None
+        self.__sequence = itertools.count(1)
+
+
+    async def __aenter__(self):
+        await self.__open()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    async def __open(self):
+        if self.__open_lock is None:
+            self.__open_lock = asyncio.Lock()
+
+        async with self.__open_lock:
+            if self.__response_transport:
+                return
+
+            loop = asyncio.get_running_loop()
+            self.__response_transport, protocol = await loop.create_datagram_endpoint(
+                lambda: asyncResponseProtocol(self.__waiters),
+                local_addr=('0.0.0.0', 0))
+            self.__request_transport, protocol = await loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol,
+                remote_addr=(constants.MCAST_DISCOVER_GRP, constants.MCAST_DISCOVER_SERVER_PORT))
+
+
+    async def __getServiceIP(self, service_name, timeout=5, retry=0):
+        await self.__open()
+
+        port = self.__response_transport.get_extra_info('sockname')[1]
+        request = constants.DISCOVER_MSG_REQUEST.replace(constants.SERVICE_LABEL, service_name).encode() + constants.PORT_SEP + str(port).encode() + constants.PORT_SEP + str(next(self.__sequence)).encode()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__waiters.setdefault(service_name, []).append(future)
+
+        try:
+            i = 0
+            while retry < 0 or i <= retry:
+
+                # Resend each sync period in case the master is still being elected
+                deadline = loop.time() + timeout
+                while loop.time() < deadline:
+                    self.__request_transport.sendto(request)
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(future), min(constants.MCAST_SYNC_SEND_TIME, deadline - loop.time()))
+
+                    except asyncio.TimeoutError:
+                        pass
+
+                i += 1
+
+            return None, None
+
+        finally:
+            waiters = self.__waiters.get(service_name)
+            if waiters and future in waiters:
+                waiters.remove(future)
+                if not waiters:
+                    del self.__waiters[service_name]
+
+
+    async def getServiceIP(self, service_name, timeout=5, retry=0):
+        ip, port = await self.__getServiceIP(service_name, timeout, retry)
+        return ip
+
+
+    async def getServiceIPAndPort(self, service_name, timeout=5, retry=0):
+        ip, port = await self.__getServiceIP(service_name, timeout, retry)
+        return ip, port
+
+
+    def close(self):
+        if self.__request_transport:
+            self.__request_transport.close()
+            self.__request_transport = None
+        if self.__response_transport:
+            self.__response_transport.close()
+            self.__response_transport = None
+        for waiters in self.__waiters.values():
+            for future in waiters:
+                future.cancel()
+        self.__waiters.clear()
@@ -0,0 +1,327 @@
+#! /usr/bin/python3
+# 
+# This file is part of the ServiceDiscovery distribution.
+# Copyright (c) 2023 Javier Moreno Garcia.
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but 
+# WITHOUT ANY WARRANTY; without even the implied warranty of 
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU 
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License 
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import ServiceDiscovery
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def waitMaster(daemons, timeout, start_time=None):
+    start_time = start_time if start_time != None else time.monotonic()
+    while [daemon.isMaster() for daemon in daemons].count(True) != 1:
+        if time.monotonic() - start_time > timeout:
+            return None
+        time.sleep(0.001)
+    return time.monotonic() - start_time
+
+
+def createDaemons(service_name, count, **options):
+    daemons = []
+    for i in range(count):
+        daemon = ServiceDiscovery.daemon(service_name, **options)
+        daemon.setPort(1000 + i)
+        daemons.append(daemon)
+    return daemons
+
+
+def startDaemons(service_name, count, **options):
+    daemons = createDaemons(service_name, count, **options)
+    for daemon in daemons:
+        daemon.run()
+    return daemons
+
+
+def stopDaemons(daemons):
+    for daemon in daemons:
+        daemon.stop()
+
+
+def measureLatency(service_name, lookups, timeout, fault_injector=None):
+    client = ServiceDiscovery.client(fast_lookup=True, fault_injector=fault_injector)
+    latencies = []
+    errors = 0
+    for i in range(lookups):
+        start_time = time.perf_counter()
+        ip, port = client.getServiceIPAndPort(service_name, timeout)
+        if ip == None:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - start_time) * 1000)
+
+    return {
+        "lookups": lookups,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99)
+    }
+
+
+def measureThroughput(service_name, clients, lookups, timeout):
+    errors = [0] * clients
+    # Every client goes to the network, coalescing them would only measure the shared flight
+    def lookup(index):
+        client = ServiceDiscovery.client(fast_lookup=True, single_flight=False)
+        for i in range(lookups):
+            ip, port = client.getServiceIPAndPort(service_name, timeout)
+            if ip == None:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=lookup, args=[i]) for i in range(clients)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "clients": clients,
+        "lookups": clients * lookups,
+        "errors": sum(errors),
+        "lookups_per_s": clients * lookups / elapsed
+    }
+
+
+def measureConvergence(service_name, daemon_counts, timeout, **options):
+    convergence = {}
+    for count in daemon_counts:
+        daemons = createDaemons(service_name, count, **options)
+        start_time = time.monotonic()
+        for daemon in daemons:
+            daemon.run()
+        convergence[str(count)] = waitMaster(daemons, timeout, start_time)
+        stopDaemons(daemons)
+    return convergence
+
+
+def measureFailover(service_name, count, timeout, resign=False, **options):
+    daemons = startDaemons(service_name, count, **options)
+    if waitMaster(daemons, timeout) == None:
+        stopDaemons(daemons)
+        return None
+
+    # Let the backups hear the first heartbeats, by default the master then dies without resigning
+    sync_send_time = options.get("sync_send_time", ServiceDiscovery.constants.MCAST_SYNC_SEND_TIME)
+    time.sleep(max(sync_send_time, options.get("heartbeat_interval") or sync_send_time) * 2)
+
+    master = [daemon for daemon in daemons if daemon.isMaster()][0]
+    daemons.remove(master)
+    start_time = time.monotonic()
+    master.stop(resign)
+    elapsed = waitMaster(daemons, timeout, start_time)
+    stopDaemons(daemons)
+    return elapsed
+
+
+def countSockets():
+    try:
+        fds = os.listdir("/proc/self/fd")
+
+    except OSError:
+        return None
+
+    sockets = 0
+    for fd in fds:
+        try:
+            sockets += os.readlink("/proc/self/fd/" + fd).startswith("socket:")
+
+        except OSError:
+            pass
+    return sockets
+
+
+def measureResources(service_name, count, **options):
+    sockets = countSockets()
+    threads = threading.active_count()
+    daemons = startDaemons(service_name, count, **options)
+    sockets_used = countSockets() - sockets if sockets != None else None
+    threads_used = threading.active_count() - threads
+    stopDaemons(daemons)
+
+    return {
+        "sockets_per_daemon": sockets_used / count if sockets_used != None else None,
+        "threads_per_daemon": threads_used / count
+    }
+
+
+def measureFlood(service_name, rate, duration, timeout, sources=10, **options):
+    daemons = startDaemons(service_name, 3, **options)
+    if waitMaster(daemons, timeout) == None:
+        stopDaemons(daemons)
+        return None
+
+    master = [daemon for daemon in daemons if daemon.isMaster()][0]
+    before = master.stats()
+    elections = sum(daemon.stats()["elections_won"] for daemon in daemons)
+
+    # Every request is sent twice, as a lost reply retransmission would be
+    listeners = [ServiceDiscovery.udpRandomPortListener() for i in range(sources)]
+    mcast_send_request = ServiceDiscovery.mcast(ServiceDiscovery.constants.MCAST_DISCOVER_GRP, ServiceDiscovery.constants.MCAST_DISCOVER_SERVER_PORT)
+    request = ServiceDiscovery.constants.DISCOVER_MSG_REQUEST.replace(ServiceDiscovery.constants.SERVICE_LABEL, service_name)
+    requests = [(request + "#%d#%d" % (listener.port, i)).encode() for listener in listeners for i in range(int(rate * duration) // (2 * sources) + 1)]
+    sent = [0]
+
+    def flood():
+        start_time = time.monotonic()
+        while sent[0] < rate * duration:
+            if sent[0] > (time.monotonic() - start_time) * rate:
+                time.sleep(0.001)
+                continue
+            mcast_send_request.send(requests[(sent[0] // 2) % len(requests)])
+            sent[0] += 1
+
+    thread = threading.Thread(target=flood)
+    thread.start()
+    client = ServiceDiscovery.client(fast_lookup=True)
+    latencies = []
+    errors = 0
+    while thread.is_alive():
+        start_time = time.perf_counter()
+        ip, port = client.getServiceIPAndPort(service_name, timeout)
+        if ip == None:
+            errors += 1
+        else:
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        time.sleep(0.01)
+    thread.join()
+
+    after = master.stats()
+    results = {
+        "requests_sent": sent[0],
+        "master_kept": master.isMaster() and [daemon.isMaster() for daemon in daemons].count(True) == 1,
+        "elections": sum(daemon.stats()["elections_won"] for daemon in daemons) - elections,
+        "lookups": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50),
+        "max_ms": max(latencies) if latencies else None
+    }
+    for key in ("requests_received", "requests_answered", "requests_rate_limited", "requests_coalesced"):
+        results[key] = after[key] - before[key]
+
+    for listener in listeners:
+        listener.close()
+    mcast_send_request.close()
+    stopDaemons(daemons)
+    return results
+
+
+def runBenchmark(service_name="bench", clients=10, lookups=200, daemon_counts=(2, 10, 50), timeout=10, loss=0.1, flood=10000, **options):
+    results = {"version": ServiceDiscovery.version}
+
+    daemons = startDaemons(service_name, 1, **options)
+    waitMaster(daemons, timeout)
+    results["latency"] = measureLatency(service_name, lookups, timeout)
+    if loss:
+        results["latency_loss"] = measureLatency(service_name, lookups, timeout, ServiceDiscovery.faultInjector(drop=loss))
+        results["latency_loss"]["loss"] = loss
+    requests_answered = daemons[0].stats()["requests_answered"]
+    results["throughput"] = measureThroughput(service_name, clients, lookups, timeout)
+    results["throughput"]["requests_answered"] = daemons[0].stats()["requests_answered"] - requests_answered
+    stopDaemons(daemons)
+
+    results["convergence_s"] = measureConvergence(service_name, daemon_counts, timeout, **options)
+    results["failover_s"] = measureFailover(service_name, 3, timeout, **options)
+    results["resources"] = measureResources(service_name, 10, **options)
+    if flood:
+        results["flood"] = measureFlood(service_name, flood, 2, timeout, **options)
+    return results
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Service discovery benchmark, prints JSON results")
+    parser.add_argument(
+        '-s',
+        required=False,
+        default="bench",
+        help='service name',
+        type=str)
+    parser.add_argument(
+        '-c',
+        required=False,
+        default=10,
+        help='concurrent clients',
+        type=int)
+    parser.add_argument(
+        '-n',
+        required=False,
+        default=200,
+        help='lookups per client',
+        type=int)
+    parser.add_argument(
+        '-d',
+        required=False,
+        default="2,10,50",
+        help='daemon counts for the election convergence, comma separated',
+        type=str)
+    parser.add_argument(
+        '-t',
+        required=False,
+        default=10,
+        help='timeout',
+        type=float)
+    parser.add_argument(
+        '-l',
+        required=False,
+        default=0.1,
+        help='fraction of lookup packets dropped for the lossy latency run, 0 to skip it',
+        type=float)
+    parser.add_argument(
+        '-f',
+        required=False,
+        default=10000,
+        help='requests per second for the request flood run, 0 to skip it',
+        type=int)
+    parser.add_argument(
+        '-o',
+        required=False,
+        default=None,
+        help='output file',
+        type=str)
+    args = parser.parse_args(sys.argv[1:])
+
+
+    try:
+        results = runBenchmark(args.s, args.c, args.n, [int(count) for count in args.d.split(",")], args.t, args.l, args.f)
+
+    except KeyboardInterrupt:
+        return
+
+    output = json.dumps(results, indent=2)
+    if args.o:
+        with open(args.o, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+# Main execution
+if __name__ == '__main__':
+    main()
@@ -19,7 +19,66 @@
 
 import ServiceDiscovery
 import argparse
+import json
 import sys
+import threading
+import time
+
+
+def emit(output, mutex, **result):
+    with mutex:
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+
+
+def resolve(client, service_name, timeout, retry, output, mutex):
+    start_time = time.perf_counter()
+    ip, port = client.getServiceIPAndPort(service_name, timeout, retry)
+    latency = (time.perf_counter() - start_time) * 1000
+    emit(output, mutex, service=service_name, ip=ip, port=port, latency_ms=round(latency, 3), status="ok" if ip else "timeout")
+
+
+def watch(client, service_name, output, mutex):
+    def changed(service_name, ip, port):
+        emit(output, mutex, service=service_name, ip=ip, port=port, status="master" if ip else "lost")
+    client.watch(service_name, changed)
+
+
+def serviceNames(names, source):
+    for service_name in names:
+        yield service_name
+
+    if names:
+        return
+
+    for line in source:
+        service_name = line.strip()
+        if service_name:
+            yield service_name
+
+
+def stream(client, names, timeout, retry, watch_changes=False, source=sys.stdin, output=sys.stdout):
+    mutex = threading.Lock()
+    threads = []
+    seen = set()
+    for service_name in serviceNames(names, source):
+        if service_name in seen:
+            continue
+        seen.add(service_name)
+
+        # Every name resolves on its own thread so results show up as they arrive
+        thread = threading.Thread(target=resolve, daemon=True, args=[client, service_name, timeout, retry, output, mutex])
+        thread.start()
+        threads.append(thread)
+        if watch_changes:
+            watch(client, service_name, output, mutex)
+
+    for thread in threads:
+        thread.join()
+
+    while watch_changes:
+        time.sleep(1)
+
 
 def main():
 
@@ -27,28 +86,54 @@ def main():
     parser = argparse.ArgumentParser(description="Service discovery client")
     parser.add_argument(
         "service_name",
-        nargs=1,
-        help="Service name",
+        nargs="*",
+        help="Service names, read from stdin one per line when streaming without names",
         type=str)
     parser.add_argument(
         '-t',
         required=False,
         default=3,
         help='timeout',
-        type=int)
+        type=float)
     parser.add_argument(
         '-r',
         required=False,
         default=-1,
         help='retries',
         type=int)
+    parser.add_argument(
+        '-f',
+        required=False,
+        action='store_true',
+        help='fast lookup, skip sync wait when the master answers right away')
+    parser.add_argument(
+        '-j',
+        '--json',
+        required=False,
+        action='store_true',
+        help='stream mode, resolve every name concurrently and print JSON lines')
+    parser.add_argument(
+        '-w',
+        '--watch',
+        required=False,
+        action='store_true',
+        help='stream mode, keep running and print a JSON line on every master change')
     args = parser.parse_args(sys.argv[1:])
 
 
-    client = ServiceDiscovery.client()
+    if not args.json and not args.watch and len(args.service_name) != 1:
+        parser.error("one service name expected, use -j to resolve several")
+
     try:
-        ip = client.getServiceIP(args.service_name[0], args.t, args.r)
-        print(ip)
+        if args.json or args.watch:
+            client = ServiceDiscovery.client(fast_lookup=args.f, persistent=True)
+            stream(client, args.service_name, args.t, args.r, args.watch)
+            client.close()
+
+        else:
+            client = ServiceDiscovery.client(fast_lookup=args.f)
+            ip = client.getServiceIP(args.service_name[0], args.t, args.r)
+            print(ip)
 
     except KeyboardInterrupt:
         pass
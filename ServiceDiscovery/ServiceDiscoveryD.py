@@ -20,6 +20,18 @@ import argparse
 import ServiceDiscovery
 import sys
 
+
+# tcp:PORT or http:PORT/path
+def healthCheck(spec):
+    kind, sep, target = spec.partition(":")
+    port, sep, path = target.partition("/")
+    if kind == "tcp" and port.isdigit():
+        return ServiceDiscovery.tcpHealthCheck(port=int(port))
+    elif kind == "http" and port.isdigit():
+        return ServiceDiscovery.httpHealthCheck("/" + path, port=int(port))
+    raise argparse.ArgumentTypeError("expected tcp:PORT or http:PORT/path")
+
+
 def main():
 
     parser = argparse.ArgumentParser(description="Service discovery damemon")
@@ -28,11 +40,45 @@ def main():
         nargs=1,
         help="Service name",
         type=str)
+    parser.add_argument(
+        '-p',
+        required=False,
+        action='store_true',
+        help='cold start probe, claim mastery at once when no peer answers')
+    parser.add_argument(
+        '-l',
+        required=False,
+        action='store_true',
+        help='load balance, answer instance lookups as a backup too')
+    parser.add_argument(
+        '-w',
+        required=False,
+        default=ServiceDiscovery.constants.WEIGHT,
+        help='instance weight',
+        type=int)
+    parser.add_argument(
+        '-c',
+        required=False,
+        default=None,
+        help='health check, tcp:PORT or http:PORT/path, resign mastery while it fails',
+        type=healthCheck)
+    parser.add_argument(
+        '-i',
+        required=False,
+        default=ServiceDiscovery.constants.HEALTH_INTERVAL,
+        help='health check interval',
+        type=float)
+    parser.add_argument(
+        '-n',
+        required=False,
+        default=ServiceDiscovery.constants.HEALTH_FAILURES,
+        help='health check failures before resigning',
+        type=int)
     args = parser.parse_args(sys.argv[1:])
 
 
     try:
-        daemon = ServiceDiscovery.daemon(args.service_name[0])
+        daemon = ServiceDiscovery.daemon(args.service_name[0], weight=args.w, health_check=args.c, cold_start_probe=args.p, load_balance=args.l, health_interval=args.i, health_failures=args.n)
         daemon.run()
 
     except KeyboardInterrupt:
@@ -0,0 +1,52 @@
+#! /usr/bin/python3
+# 
+# This file is part of the ServiceDiscovery distribution.
+# Copyright (c) 2023 Javier Moreno Garcia.
+# 
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful, but 
+# WITHOUT ANY WARRANTY; without even the implied warranty of 
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU 
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License 
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+import argparse
+import ServiceDiscovery
+import sys
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Service discovery host resolver")
+    parser.add_argument(
+        '-s',
+        required=False,
+        default=ServiceDiscovery.constants.RESOLVER_PATH,
+        help='unix socket path',
+        type=str)
+    parser.add_argument(
+        '-b',
+        required=False,
+        action='store_true',
+        help='binary protocol')
+    args = parser.parse_args(sys.argv[1:])
+
+
+    resolver = ServiceDiscovery.resolver(args.s, binary_protocol=args.b)
+    try:
+        resolver.run().join()
+
+    except KeyboardInterrupt:
+        pass
+
+    resolver.stop()
+
+
+# Main execution
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,9 @@ if __name__ == '__main__':
         entry_points={
             'console_scripts': [
                 'ServiceDiscoveryD=ServiceDiscovery.ServiceDiscoveryD:main',
-                'ServiceDiscoveryC=ServiceDiscovery.ServiceDiscoveryC:main'
+                'ServiceDiscoveryC=ServiceDiscovery.ServiceDiscoveryC:main',
+                'ServiceDiscoveryBench=ServiceDiscovery.ServiceDiscoveryBench:main',
+                'ServiceDiscoveryR=ServiceDiscovery.ServiceDiscoveryR:main'
             ],
         },
         install_requires = [],
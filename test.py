@@ -17,10 +17,20 @@
 #
 
 
+import asyncio
+import http.server
+import io
+import json
+import os
+import re
+import socket
 import unittest
 import ServiceDiscovery
+import ServiceDiscovery.ServiceDiscoveryBench
+import ServiceDiscovery.ServiceDiscoveryC
 import time
 import threading
+import urllib.request
 import weakref
 
 TEST_SERVICE_NAME = "test"
@@ -60,6 +70,15 @@ class ServiceDiscover(unittest.TestCase):
         self.assertTrue(ip != "")
         self.assertTrue(len(ip.split(".")) == 4)
 
+        # Requests asking for replies on impossible ports are ignored
+        mcast_send_request = ServiceDiscovery.mcast(ServiceDiscovery.constants.MCAST_DISCOVER_GRP, ServiceDiscovery.constants.MCAST_DISCOVER_SERVER_PORT)
+        for port in (b"70000", b"0"):
+            mcast_send_request.send(ServiceDiscovery.constants.DISCOVER_MSG_REQUEST.replace(ServiceDiscovery.constants.SERVICE_LABEL, TEST_SERVICE_NAME).encode() + b"#" + port)
+        mcast_send_request.close()
+        time.sleep(0.1)
+        self.assertTrue(test1.getServiceIP(TEST_SERVICE_NAME, timeout=1) == ip)
+        broker_discover.stop()
+
 
     def test3_getMultipleServiceSync(self):
 
@@ -163,5 +182,1086 @@ class ServiceDiscover(unittest.TestCase):
         self.assertTrue(ok)
 
 
+    def test6_cachedServiceIPAndPort(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(2)
+
+        test1 = ServiceDiscovery.client(cache_ttl=10, negative_cache_ttl=10)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(ip != None)
+        self.assertTrue(port == 1001)
+
+        start_time = time.monotonic()
+        cached_ip, cached_port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(time.monotonic() - start_time < 0.01)
+        self.assertTrue(cached_ip == ip)
+        self.assertTrue(cached_port == port)
+
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=1)
+        self.assertTrue(ip == None)
+        start_time = time.monotonic()
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=1)
+        self.assertTrue(ip == None)
+        self.assertTrue(time.monotonic() - start_time < 0.01)
+
+        test1.invalidate(TEST_SERVICE_NAME)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port == 1001)
+        test1.close()
+        broker_discover.stop()
+
+
+        # Entries pointing to a master that resigned or whose beacons carry another port are dropped
+        options = dict(sync_send_time=0.05, read_own_max_count=2, heartbeat_interval=0.05)
+        for binary_protocol, resign in ((False, True), (True, True), (True, False)):
+            daemons = []
+            for i in range(2):
+                broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, binary_protocol=binary_protocol, **options)
+                broker_discover.setPort(3100 + i)
+                broker_discover.run()
+                daemons.append(broker_discover)
+
+            while [daemon.isMaster() for daemon in daemons].count(True) != 1:
+                time.sleep(0.01)
+            time.sleep(0.3)
+            master = [daemon for daemon in daemons if daemon.isMaster()][0]
+            daemons.remove(master)
+
+            test1 = ServiceDiscovery.client(cache_ttl=30, binary_protocol=binary_protocol)
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+            self.assertTrue(port == master.getPort())
+
+            master.stop(resign)
+            while not daemons[0].isMaster():
+                time.sleep(0.01)
+            time.sleep(0.3)
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+            self.assertTrue(port == daemons[0].getPort())
+            test1.close()
+            daemons[0].stop()
+
+
+    def test7_fastLookup(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(2)
+
+        test1 = ServiceDiscovery.client(fast_lookup=True)
+        start_time = time.monotonic()
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(time.monotonic() - start_time < 0.1)
+        self.assertTrue(ip != None)
+        self.assertTrue(port == 1001)
+
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=1)
+        self.assertTrue(ip == None)
+
+
+    def test8_asyncConcurrentLookup(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(2)
+
+        async def lookup():
+            async with ServiceDiscovery.asyncClient() as test1:
+                results = await asyncio.gather(*[test1.getServiceIPAndPort(TEST_SERVICE_NAME) for i in range(200)])
+                unknown = await test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=1)
+                return results, unknown
+
+        results, unknown = asyncio.run(lookup())
+        self.assertTrue(len(results) == 200)
+        self.assertTrue(all(port == 1001 and ip != None for ip, port in results))
+        self.assertTrue(unknown == (None, None))
+
+
+    def test9_batchLookup(self):
+
+        daemons = []
+        for i in range(5):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME + str(i))
+            broker_discover.setPort(1000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+        time.sleep(2)
+
+        service_names = [TEST_SERVICE_NAME + str(i) for i in range(5)] + [TEST_SERVICE_NAME + "_unknown"]
+        test1 = ServiceDiscovery.client()
+        start_time = time.monotonic()
+        results = test1.getServices(service_names, timeout=1)
+        self.assertTrue(time.monotonic() - start_time < 1.5)
+
+        for i in range(5):
+            ip, port = results[TEST_SERVICE_NAME + str(i)]
+            self.assertTrue(ip != None)
+            self.assertTrue(port == 1000 + i)
+        self.assertTrue(results[TEST_SERVICE_NAME + "_unknown"] == (None, None))
+
+
+    def test10_daemonHost(self):
+
+        threads = threading.active_count()
+        host = ServiceDiscovery.daemonHost()
+        for i in range(20):
+            host.register(TEST_SERVICE_NAME + str(i), 1000 + i)
+        host.run()
+        self.assertTrue(threading.active_count() - threads == 1)
+        time.sleep(2)
+
+        test1 = ServiceDiscovery.client()
+        results = test1.getServices([TEST_SERVICE_NAME + str(i) for i in range(20)], timeout=1)
+        for i in range(20):
+            self.assertTrue(host.isMaster(TEST_SERVICE_NAME + str(i)))
+            self.assertTrue(results[TEST_SERVICE_NAME + str(i)][1] == 1000 + i)
+
+        host.unregister(TEST_SERVICE_NAME + "0")
+        self.assertTrue(len(host.services()) == 19)
+        host.stop()
+
+
+        # A callback failing on one request leaves the engine serving every service
+        class faultyTransport(ServiceDiscovery.udpTransport):
+            def mcast(self, ip, port):
+                sock = super().mcast(ip, port)
+                read = sock.read
+                def faultyRead(timeout=-1):
+                    data, ip, port = read(timeout)
+                    if data and data.endswith(b"#boom"):
+                        raise ValueError(data)
+                    return data, ip, port
+                sock.read = faultyRead
+                return sock
+
+        host = ServiceDiscovery.daemonHost(transport=faultyTransport())
+        host.register(TEST_SERVICE_NAME + "0", 1000)
+        host.run()
+        while not host.isMaster(TEST_SERVICE_NAME + "0"):
+            time.sleep(0.01)
+        mcast_send_request = ServiceDiscovery.mcast(ServiceDiscovery.constants.MCAST_DISCOVER_GRP, ServiceDiscovery.constants.MCAST_DISCOVER_SERVER_PORT)
+        mcast_send_request.send(b"#boom")
+        mcast_send_request.close()
+        time.sleep(0.1)
+        self.assertTrue(host.stats()["callback_errors"] == 1)
+        self.assertTrue(ServiceDiscovery.client(fast_lookup=True).getServiceIPAndPort(TEST_SERVICE_NAME + "0", timeout=1)[1] == 1000)
+        host.stop()
+
+        # Registering more services than the wakeup pair can buffer before the engine runs
+        host = ServiceDiscovery.daemonHost()
+        for i in range(500):
+            host.register(TEST_SERVICE_NAME + str(i), 1000 + i)
+        host.run()
+        start_time = time.monotonic()
+        while not all(host.isMaster(TEST_SERVICE_NAME + str(i)) for i in range(500)):
+            self.assertTrue(time.monotonic() - start_time < 5)
+            time.sleep(0.01)
+        host.stop()
+
+
+    def test11_persistentClient(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(2)
+
+        def clientThread(test1, results, mutex):
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+            with mutex:
+                results.append(port)
+
+        with ServiceDiscovery.client(persistent=True, fast_lookup=True) as test1:
+            results = []
+            threads = []
+            save_result_mutex = threading.RLock()
+            for i in range(50):
+                thread = threading.Thread(target=clientThread, daemon=True, args=[test1, results, save_result_mutex])
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+
+            self.assertTrue(results == [1001] * 50)
+            self.assertTrue(test1.getServices([TEST_SERVICE_NAME])[TEST_SERVICE_NAME][1] == 1001)
+
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=1)
+            self.assertTrue(ip == None)
+
+
+    def test12_binaryProtocol(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME + ".*", binary_protocol=True)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(2)
+
+        test1 = ServiceDiscovery.client(binary_protocol=True)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + ".*")
+        self.assertTrue(ip != None)
+        self.assertTrue(port == 1001)
+
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + ".x", timeout=1)
+        self.assertTrue(ip == None)
+        broker_discover.stop()
+
+        # Ports the header can not carry still work in text, binary replies leave them out
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME + ".port")
+        broker_discover.setPort("8080")
+        broker_discover.run()
+        while not broker_discover.isMaster():
+            time.sleep(0.01)
+        self.assertTrue(test1.getServiceIPAndPort(TEST_SERVICE_NAME + ".port")[1] == 8080)
+        broker_discover.setPort(70000)
+        self.assertTrue(ServiceDiscovery.client().getServiceIPAndPort(TEST_SERVICE_NAME + ".port")[1] == 70000)
+        self.assertTrue(test1.getServiceIPAndPort(TEST_SERVICE_NAME + ".port")[1] == None)
+        broker_discover.stop()
+
+        # Text names starting with the magic byte stay text, only an exact version 1 header is binary
+        armenian_name = "\u0556\u0561\u057d\u057f-" + TEST_SERVICE_NAME
+        self.assertTrue(armenian_name.encode()[0] == ServiceDiscovery.constants.BINARY_MAGIC)
+        self.assertTrue(ServiceDiscovery.binaryProtocol.unpack((armenian_name + ".123456").encode()) == None)
+        header = ServiceDiscovery.binaryProtocol.pack(ServiceDiscovery.constants.BINARY_SYNC, 1, 2, 1001)
+        self.assertTrue(ServiceDiscovery.binaryProtocol.unpack(header) == (ServiceDiscovery.constants.BINARY_SYNC, 1, 2, 1001))
+        self.assertTrue(ServiceDiscovery.binaryProtocol.unpack(header + b'x') == None)
+        self.assertTrue(ServiceDiscovery.binaryProtocol.unpack(header[:3] + b'\x01' + header[4:]) == None)
+        self.assertTrue(ServiceDiscovery.binaryProtocol.unpack(header[:1] + b'\x02' + header[2:]) == None)
+        broker_discover = ServiceDiscovery.daemon(armenian_name)
+        broker_discover.setPort(1002)
+        broker_discover.run()
+        time.sleep(2)
+        self.assertTrue(broker_discover.isMaster())
+        self.assertTrue(ServiceDiscovery.client().getServiceIPAndPort(armenian_name)[1] == 1002)
+        broker_discover.stop()
+
+
+        # Sync parsing throughput, binary header against the legacy regex match
+        count = 100000
+        binary_sync = ServiceDiscovery.binaryProtocol.pack(ServiceDiscovery.constants.BINARY_SYNC, ServiceDiscovery.binaryProtocol.serviceId(TEST_SERVICE_NAME), 123456, 1001)
+        legacy_sync = (TEST_SERVICE_NAME + ".123456").encode()
+
+        start_time = time.perf_counter()
+        for i in range(count):
+            ServiceDiscovery.binaryProtocol.unpack(binary_sync)
+        binary_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for i in range(count):
+            if re.match("^" + TEST_SERVICE_NAME + "\\.\\d*$", legacy_sync.decode()):
+                int(legacy_sync.split(b'.')[1].decode())
+        legacy_time = time.perf_counter() - start_time
+
+        self.assertTrue(binary_time < legacy_time)
+
+
+    def test13_watchMaster(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+
+        events = []
+        event_received = threading.Event()
+        def onMasterChange(service_name, ip, port):
+            events.append((service_name, ip, port))
+            event_received.set()
+
+        test1 = ServiceDiscovery.client()
+        self.assertTrue(test1.watch(TEST_SERVICE_NAME, onMasterChange))
+
+        self.assertTrue(event_received.wait(5))
+        event_received.clear()
+        self.assertTrue(events[-1][0] == TEST_SERVICE_NAME)
+        self.assertTrue(events[-1][2] == 1001)
+
+        broker_discover.stop()
+        self.assertTrue(event_received.wait(3))
+        event_received.clear()
+        self.assertTrue(events[-1][1:] == (None, None))
+
+        broker_discover2 = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover2.setPort(1002)
+        broker_discover2.run()
+        self.assertTrue(event_received.wait(5))
+        self.assertTrue(events[-1][2] == 1002)
+
+        test1.unwatch(TEST_SERVICE_NAME)
+        test1.close()
+        broker_discover2.stop()
+
+
+        # A backup on the same host takes over from a crashed master faster than the loss window
+        options = dict(sync_send_time=0.03, read_own_max_count=2, heartbeat_interval=0.03, heartbeat_miss_count=3)
+        daemons = []
+        for i in range(5):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, **options)
+            broker_discover.setPort(3000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1:
+            time.sleep(0.01)
+        time.sleep(0.3)
+
+        # The election may still settle, the watch reports whoever ends up master
+        events = []
+        event_received.clear()
+        test1 = ServiceDiscovery.client()
+        self.assertTrue(test1.watch(TEST_SERVICE_NAME, onMasterChange))
+        self.assertTrue(event_received.wait(5))
+        time.sleep(0.3)
+        master = [daemon for daemon in daemons if daemon.isMaster()][0]
+        daemons.remove(master)
+        self.assertTrue(events[-1][2] == master.getPort())
+
+        master.stop(resign=False)
+        start_time = time.monotonic()
+        while not events or events[-1][2] == master.getPort():
+            self.assertTrue(time.monotonic() - start_time < 2)
+            time.sleep(0.01)
+        self.assertTrue(events[-1][2] == [daemon for daemon in daemons if daemon.isMaster()][0].getPort())
+
+        test1.close()
+        for broker_discover in daemons:
+            broker_discover.stop()
+
+
+    def test14_priorityElectionConvergence(self):
+
+        convergence = {}
+        for count in (2, 10, 50, 100):
+
+            daemons = []
+            for i in range(count):
+                election = ServiceDiscovery.priorityElection(priority=10 if i == count // 2 else 1, node_id=i)
+                broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, election=election, sync_send_time=0.05, sync_read_time=0.1, read_own_max_count=2)
+                daemons.append(broker_discover)
+
+            start_time = time.monotonic()
+            for broker_discover in daemons:
+                broker_discover.run()
+
+            while [daemon.isMaster() for daemon in daemons].count(True) != 1 and time.monotonic() - start_time < 5:
+                time.sleep(0.005)
+            convergence[count] = time.monotonic() - start_time
+
+            # Mastery is stable and goes to the highest priority
+            time.sleep(0.5)
+            masters = [i for i, daemon in enumerate(daemons) if daemon.isMaster()]
+            self.assertTrue(masters == [count // 2])
+
+            for broker_discover in daemons:
+                broker_discover.stop()
+
+        self.assertTrue(all(elapsed < 2 for elapsed in convergence.values()))
+
+
+    def test15_masterFailover(self):
+
+        options = dict(sync_send_time=0.03, read_own_max_count=2, heartbeat_interval=0.03, heartbeat_miss_count=3)
+        daemons = []
+        for i in range(10):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, **options)
+            broker_discover.setPort(1000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+
+        start_time = time.monotonic()
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1 and time.monotonic() - start_time < 5:
+            time.sleep(0.005)
+        time.sleep(0.5)
+
+        # The master dies without resigning, the backups only miss its heartbeats
+        master = [daemon for daemon in daemons if daemon.isMaster()][0]
+        daemons.remove(master)
+        start_time = time.monotonic()
+        master.stop(resign=False)
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1 and time.monotonic() - start_time < 5:
+            time.sleep(0.002)
+        failover = time.monotonic() - start_time
+        self.assertTrue(failover < 0.3)
+
+        time.sleep(0.5)
+        self.assertTrue([daemon.isMaster() for daemon in daemons].count(True) == 1)
+
+        test1 = ServiceDiscovery.client()
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port != master.getPort())
+
+
+    def test16_gracefulHandoff(self):
+
+        daemons = []
+        for i in range(3):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+            broker_discover.setPort(1000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+
+        start_time = time.monotonic()
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1 and time.monotonic() - start_time < 5:
+            time.sleep(0.01)
+        time.sleep(0.6)
+
+        test1 = ServiceDiscovery.client(fast_lookup=True)
+        for resign in ("stop", "disable"):
+
+            time.sleep(0.1)
+            master = [daemon for daemon in daemons if daemon.isMaster()][0]
+            daemons.remove(master)
+            start_time = time.monotonic()
+            if resign == "stop":
+                master.stop()
+            else:
+                master.setEnable(False)
+
+            # Lookup downtime stays within one beacon interval
+            while time.monotonic() - start_time < 5:
+                ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME, timeout=1)
+                if port != None and port != master.getPort():
+                    break
+            self.assertTrue(time.monotonic() - start_time < ServiceDiscovery.constants.MCAST_SYNC_SEND_TIME)
+            self.assertFalse(master.isMaster())
+            self.assertTrue([daemon.isMaster() for daemon in daemons].count(True) == 1)
+
+
+    def test17_coldStartProbe(self):
+
+        # A lone daemon claims mastery once the probe window passes unanswered
+        start_time = time.monotonic()
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, cold_start_probe=True)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        while not broker_discover.isMaster() and time.monotonic() - start_time < 5:
+            time.sleep(0.005)
+        self.assertTrue(time.monotonic() - start_time < ServiceDiscovery.constants.MCAST_SYNC_SEND_TIME)
+
+        test1 = ServiceDiscovery.client(fast_lookup=True)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port == 1001)
+
+        # Peers answer the probe, a newcomer joins the election instead of claiming
+        broker_discover2 = ServiceDiscovery.daemon(TEST_SERVICE_NAME, cold_start_probe=True)
+        broker_discover2.setPort(1002)
+        broker_discover2.run()
+        time.sleep(1)
+        self.assertTrue(broker_discover.isMaster())
+        self.assertFalse(broker_discover2.isMaster())
+
+        broker_discover.stop()
+        broker_discover2.stop()
+
+        # Daemons probing together hear each other and elect one master
+        daemons = []
+        for i in range(5):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, cold_start_probe=True)
+            broker_discover.run()
+            daemons.append(broker_discover)
+        time.sleep(2)
+        self.assertTrue([daemon.isMaster() for daemon in daemons].count(True) == 1)
+
+        for broker_discover in daemons:
+            broker_discover.stop()
+
+
+    def test18_benchmark(self):
+
+        options = dict(sync_send_time=0.05, sync_read_time=0.1, read_own_max_count=2)
+        results = ServiceDiscovery.ServiceDiscoveryBench.runBenchmark(TEST_SERVICE_NAME, clients=4, lookups=50, daemon_counts=(2, 10), timeout=5, flood=0, **options)
+        results = json.loads(json.dumps(results))
+
+        self.assertTrue(results["latency"]["errors"] == 0)
+        self.assertTrue(results["latency"]["p50_ms"] <= results["latency"]["p95_ms"] <= results["latency"]["p99_ms"])
+        self.assertTrue(results["latency_loss"]["errors"] == 0)
+        self.assertTrue(results["throughput"]["errors"] == 0)
+        self.assertTrue(results["throughput"]["lookups_per_s"] > 0)
+        self.assertTrue(all(elapsed != None for elapsed in results["convergence_s"].values()))
+        self.assertTrue(results["failover_s"] != None)
+        self.assertTrue(results["resources"]["threads_per_daemon"] == 1)
+
+
+    def test19_metrics(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, cold_start_probe=True, metrics_port=0)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(0.5)
+
+        test1 = ServiceDiscovery.client(fast_lookup=True, metrics_port=0)
+        for i in range(10):
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+            self.assertTrue(port == 1001)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=0.2)
+        self.assertTrue(ip == None)
+        time.sleep(0.1)
+
+        daemon_stats = broker_discover.stats()
+        self.assertTrue(daemon_stats["master"])
+        self.assertTrue(daemon_stats["elections_won"] == 1)
+        self.assertTrue(daemon_stats["requests_answered"] >= 10)
+        self.assertTrue(daemon_stats["requests_received"] >= daemon_stats["requests_answered"])
+        self.assertTrue(daemon_stats["beacons_sent"] > 0 and daemon_stats["beacons_received"] > 0)
+        self.assertTrue(0 < daemon_stats["master_time"] < 5)
+
+        client_stats = test1.stats()
+        self.assertTrue(client_stats["lookups"] == 11)
+        self.assertTrue(client_stats["lookup_timeouts"] == 1)
+        self.assertTrue(client_stats["lookup_time"]["count"] == 11)
+
+        # Prometheus text endpoints on local ports
+        metrics = urllib.request.urlopen("http://127.0.0.1:%d/metrics" % broker_discover.metricsPort(), timeout=5).read().decode()
+        self.assertTrue('servicediscovery_daemon_master{service="%s"} 1' % TEST_SERVICE_NAME in metrics)
+        metrics = urllib.request.urlopen("http://127.0.0.1:%d/metrics" % test1.metricsPort(), timeout=5).read().decode()
+        self.assertTrue("servicediscovery_client_lookups_total 11" in metrics)
+        self.assertTrue('servicediscovery_client_lookup_seconds_bucket{le="+Inf"} 11' in metrics)
+
+        test1.close()
+        broker_discover.stop()
+        self.assertTrue(broker_discover.stats()["masteries_lost"] == 1)
+
+
+    def test20_loadBalance(self):
+
+        daemons = []
+        for i, weight in enumerate((1, 1, 2)):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, weight=weight, load_balance=True)
+            broker_discover.setPort(1001 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+        time.sleep(0.2)
+
+        # Every enabled instance answers, master or not
+        for binary_protocol in (False, True):
+            test1 = ServiceDiscovery.client(binary_protocol=binary_protocol)
+            instances = test1.getServiceInstances(TEST_SERVICE_NAME)
+            self.assertTrue(sorted((port, weight) for ip, port, weight in instances) == [(1001, 1), (1002, 1), (1003, 2)])
+
+        daemons[1].setEnable(False)
+        self.assertTrue(sorted(port for ip, port, weight in test1.getServiceInstances(TEST_SERVICE_NAME)) == [1001, 1003])
+        daemons[1].setEnable(True)
+
+        # Round robin spreads evenly, weighted selection follows the weights
+        test1 = ServiceDiscovery.client(cache_ttl=10)
+        ports = [test1.getServiceInstance(TEST_SERVICE_NAME)[1] for i in range(30)]
+        self.assertTrue(all(ports.count(port) == 10 for port in (1001, 1002, 1003)))
+
+        test1 = ServiceDiscovery.client(cache_ttl=10, balancer=ServiceDiscovery.weightedBalancer())
+        ports = [test1.getServiceInstance(TEST_SERVICE_NAME)[1] for i in range(400)]
+        self.assertTrue(150 < ports.count(1003) < 250)
+
+        daemons[2].setWeight(0)
+        test1.invalidate()
+        ports = [test1.getServiceInstance(TEST_SERVICE_NAME)[1] for i in range(50)]
+        self.assertTrue(1003 not in ports)
+
+        for broker_discover in daemons:
+            broker_discover.stop()
+
+
+        # Names that look like an instance request still resolve as usual
+        broker_discover = ServiceDiscovery.daemon("all " + TEST_SERVICE_NAME, load_balance=True)
+        broker_discover.setPort(1004)
+        broker_discover.run()
+        while not broker_discover.isMaster():
+            time.sleep(0.01)
+        test1 = ServiceDiscovery.client(fast_lookup=True)
+        self.assertTrue(test1.getServiceIPAndPort("all " + TEST_SERVICE_NAME)[1] == 1004)
+        self.assertTrue([port for ip, port, weight in test1.getServiceInstances("all " + TEST_SERVICE_NAME)] == [1004])
+        broker_discover.stop()
+
+
+    def test21_adaptiveBeacon(self):
+
+        options = dict(sync_send_time=0.05, sync_read_time=0.1, read_own_max_count=2, heartbeat_max_interval=0.4)
+        packets = {}
+        for count in (5, 20):
+
+            daemons = []
+            for i in range(count):
+                broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, **options)
+                broker_discover.run()
+                daemons.append(broker_discover)
+
+            start_time = time.monotonic()
+            while [daemon.isMaster() for daemon in daemons].count(True) != 1 and time.monotonic() - start_time < 5:
+                time.sleep(0.005)
+            master = [daemon for daemon in daemons if daemon.isMaster()][0]
+            time.sleep(2)
+
+            # Steady state, only the backed off master beacons
+            sync_listener = ServiceDiscovery.mcast(ServiceDiscovery.constants.MCAST_DISCOVER_GRP, ServiceDiscovery.constants.MCAST_DISCOVER_SYNC_PORT)
+            packets[count] = 0
+            end_time = time.monotonic() + 2
+            while time.monotonic() < end_time:
+                received_response, ip, port = sync_listener.read(0.1)
+                if received_response and received_response.startswith(TEST_SERVICE_NAME.encode() + ServiceDiscovery.constants.SYNC_SEP):
+                    packets[count] += 1
+            sync_listener.close()
+
+            # Backups follow the slower pace without taking over
+            self.assertTrue(master.isMaster())
+            self.assertTrue([daemon.isMaster() for daemon in daemons].count(True) == 1)
+            self.assertTrue(all(daemon.stats()["elections_won"] == 0 for daemon in daemons if daemon is not master))
+
+            for broker_discover in daemons:
+                broker_discover.stop()
+
+        self.assertTrue(all(count <= 2 / 0.4 + 1 for count in packets.values()))
+
+
+        # Longer backoffs are capped so clients waiting for a beacon still find the master
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, heartbeat_max_interval=3)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(4)
+        for test1 in (ServiceDiscovery.client(), ServiceDiscovery.client(persistent=True)):
+            for i in range(3):
+                self.assertTrue(test1.getServiceIPAndPort(TEST_SERVICE_NAME, timeout=1)[1] == 1001)
+            test1.close()
+        broker_discover.stop()
+
+
+    def test22_resolver(self):
+
+        resolver_path = "/tmp/ServiceDiscoveryTest.sock"
+        service_name = TEST_SERVICE_NAME + "_resolver"
+        broker_discover = ServiceDiscovery.daemon(service_name, cold_start_probe=True)
+        broker_discover.setPort(1234)
+        broker_discover.run()
+        time.sleep(0.3)
+
+        host_resolver = ServiceDiscovery.resolver(resolver_path)
+        host_resolver.run()
+        test1 = ServiceDiscovery.client(resolver_path=resolver_path)
+        ip, port = test1.getServiceIPAndPort(service_name)
+        self.assertTrue(port == 1234)
+        self.assertTrue(host_resolver.services()[service_name][1] == 1234)
+
+        # Known services come straight from the resolver table
+        latencies = []
+        for i in range(50):
+            start_time = time.perf_counter()
+            ip, port = test1.getServiceIPAndPort(service_name)
+            latencies.append(time.perf_counter() - start_time)
+            self.assertTrue(port == 1234)
+        self.assertTrue(sorted(latencies)[25] < 0.005)
+
+        # The master resigns and the resolver forgets it at once
+        broker_discover.stop()
+        time.sleep(0.1)
+        self.assertTrue(service_name not in host_resolver.services())
+
+        # Coming back does not stack another watch on the resolver client
+        watch = ServiceDiscovery.client.watch
+        watches = []
+        ServiceDiscovery.client.watch = lambda client, *args: watches.append(args) or watch(client, *args)
+        try:
+            for i in range(3):
+                broker_discover = ServiceDiscovery.daemon(service_name, cold_start_probe=True)
+                broker_discover.setPort(1234)
+                broker_discover.run()
+                ip, port = test1.getServiceIPAndPort(service_name)
+                self.assertTrue(port == 1234)
+                broker_discover.stop()
+                time.sleep(0.1)
+                self.assertTrue(service_name not in host_resolver.services())
+
+        finally:
+            ServiceDiscovery.client.watch = watch
+        self.assertTrue(watches == [])
+
+        # A second resolver never takes over a live socket
+        with self.assertRaises(OSError):
+            ServiceDiscovery.resolver(resolver_path)
+        self.assertTrue(test1.getServiceIPAndPort(service_name + "_late", timeout=0.2)[0] == None)
+
+        # Attempts left after a resolver miss go over multicast
+        broker_discover = ServiceDiscovery.daemon(service_name + "_late", cold_start_probe=True)
+        broker_discover.setPort(1236)
+        threading.Timer(1.2, broker_discover.run).start()
+        ip, port = test1.getServiceIPAndPort(service_name + "_late", timeout=1, retry=-1)
+        self.assertTrue(port == 1236)
+        broker_discover.stop()
+
+        # On the default path a crashed master is replaced by a backup on the same host
+        host_resolver.stop()
+        host_resolver = ServiceDiscovery.resolver()
+        host_resolver.run()
+        options = dict(sync_send_time=0.03, read_own_max_count=2, heartbeat_interval=0.03, heartbeat_miss_count=3)
+        daemons = []
+        for i in range(2):
+            broker_discover = ServiceDiscovery.daemon(service_name, **options)
+            broker_discover.setPort(4000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+        test2 = ServiceDiscovery.client(resolver_path=ServiceDiscovery.constants.RESOLVER_PATH)
+        start_time = time.monotonic()
+        while [daemon.getPort() for daemon in daemons if daemon.isMaster()] != [test2.getServiceIPAndPort(service_name)[1]]:
+            self.assertTrue(time.monotonic() - start_time < 5)
+            time.sleep(0.1)
+        master = [daemon for daemon in daemons if daemon.isMaster()][0]
+        daemons.remove(master)
+
+        master.stop(resign=False)
+        start_time = time.monotonic()
+        while host_resolver.services().get(service_name, (None, None))[1] != daemons[0].getPort():
+            self.assertTrue(time.monotonic() - start_time < 2)
+            time.sleep(0.01)
+        self.assertTrue(test2.getServiceIPAndPort(service_name)[1] == daemons[0].getPort())
+        daemons[0].stop()
+        host_resolver.stop()
+
+        # Without resolver the client falls back to multicast
+        self.assertFalse(os.path.exists(resolver_path))
+
+        # Only a socket left by a dead resolver is replaced
+        with open(resolver_path, "w") as resolver_file:
+            resolver_file.write("")
+        with self.assertRaises(FileExistsError):
+            ServiceDiscovery.resolver(resolver_path)
+        os.unlink(resolver_path)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(resolver_path)
+        stale.close()
+        ServiceDiscovery.resolver(resolver_path).stop()
+        self.assertFalse(os.path.exists(resolver_path))
+        broker_discover = ServiceDiscovery.daemon(service_name, cold_start_probe=True)
+        broker_discover.setPort(1235)
+        broker_discover.run()
+        time.sleep(0.3)
+        ip, port = test1.getServiceIPAndPort(service_name)
+        self.assertTrue(port == 1235)
+        broker_discover.stop()
+
+
+    def test23_streamClient(self):
+
+        daemons = []
+        for i, service_name in enumerate(("stream_a", "stream_b")):
+            broker_discover = ServiceDiscovery.daemon(service_name, cold_start_probe=True)
+            broker_discover.setPort(2000 + i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+        time.sleep(0.3)
+
+        # Names from stdin resolve concurrently, one JSON line each
+        test1 = ServiceDiscovery.client(fast_lookup=True, persistent=True)
+        output = io.StringIO()
+        start_time = time.monotonic()
+        ServiceDiscovery.ServiceDiscoveryC.stream(test1, [], 1, 0, source=io.StringIO("stream_a\nstream_b\nstream_c\nstream_d\nstream_a\n"), output=output)
+        self.assertTrue(time.monotonic() - start_time < 2)
+
+        results = {}
+        for line in output.getvalue().splitlines():
+            result = json.loads(line)
+            results[result["service"]] = result
+        self.assertTrue(len(results) == 4)
+        self.assertTrue(results["stream_a"]["port"] == 2000 and results["stream_a"]["status"] == "ok")
+        self.assertTrue(results["stream_b"]["port"] == 2001 and results["stream_b"]["latency_ms"] != None)
+        self.assertTrue(results["stream_c"]["ip"] == None and results["stream_c"]["status"] == "timeout")
+
+        # Watch mode reports the master change
+        output = io.StringIO()
+        ServiceDiscovery.ServiceDiscoveryC.watch(test1, "stream_a", output, threading.Lock())
+        time.sleep(0.5)
+        daemons[0].stop()
+        time.sleep(0.2)
+        statuses = [json.loads(line)["status"] for line in output.getvalue().splitlines()]
+        self.assertTrue(statuses == ["master", "lost"])
+
+        test1.close()
+        daemons[1].stop()
+
+
+    def test24_singleFlight(self):
+
+        daemons = []
+        for i in range(5):
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+            broker_discover.setPort(1000+i)
+            broker_discover.run()
+            daemons.append(broker_discover)
+
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1:
+            time.sleep(0.01)
+        requests = sum(daemon.stats()["requests_received"] for daemon in daemons)
+
+
+        def clientThread(results, mutex):
+            client = ServiceDiscovery.client()
+            ip, port = client.getServiceIPAndPort(TEST_SERVICE_NAME)
+            with mutex:
+                results.append((port, client.stats()["lookups_coalesced"]))
+
+        results = []
+        threads = []
+        save_result_mutex = threading.RLock()
+        for i in range(50):
+            thread = threading.Thread(target=clientThread, daemon=True, args=[results, save_result_mutex])
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+
+        # Every thread gets the master from a handful of requests
+        self.assertTrue(len(set(port for port, coalesced in results)) == 1)
+        self.assertTrue(results[0][0] != None)
+        self.assertTrue(sum(coalesced for port, coalesced in results) >= 40)
+        requests = sum(daemon.stats()["requests_received"] for daemon in daemons) - requests
+        self.assertTrue(requests <= 5 * len(daemons))
+
+        for broker_discover in daemons:
+            broker_discover.stop()
+
+
+        # A follower outlives a leader with a shorter budget
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME + "_late", cold_start_probe=True)
+        broker_discover.setPort(1236)
+        threading.Timer(0.5, broker_discover.run).start()
+        leader = threading.Thread(target=ServiceDiscovery.client().getServiceIPAndPort, args=[TEST_SERVICE_NAME + "_late", 0.3])
+        leader.start()
+        time.sleep(0.05)
+        ip, port = ServiceDiscovery.client().getServiceIPAndPort(TEST_SERVICE_NAME + "_late", 5, -1)
+        self.assertTrue(port == 1236)
+        leader.join()
+        broker_discover.stop()
+
+
+    def test25_lossyLookups(self):
+
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, cold_start_probe=True)
+        broker_discover.setPort(1001)
+        broker_discover.run()
+        time.sleep(0.3)
+
+        # Lost requests and replies are retransmitted long before the timeout
+        for persistent in (False, True):
+            fault_injector = ServiceDiscovery.faultInjector(drop=0.2, seed=1)
+            test1 = ServiceDiscovery.client(fast_lookup=True, persistent=persistent, fault_injector=fault_injector)
+            latencies = []
+            for i in range(30):
+                start_time = time.monotonic()
+                ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME, timeout=5)
+                latencies.append(time.monotonic() - start_time)
+                self.assertTrue(port == 1001)
+            test1.close()
+
+            self.assertTrue(fault_injector.dropped > 0)
+            self.assertTrue(max(latencies) < 3)
+
+        # Delayed replies still count within the deadline
+        fault_injector = ServiceDiscovery.faultInjector(delayed=1, delay=0.2)
+        test1 = ServiceDiscovery.client(fault_injector=fault_injector)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME, timeout=1)
+        self.assertTrue(port == 1001)
+        self.assertTrue(fault_injector.delayed > 0)
+
+        # Sub second timeouts are honoured
+        start_time = time.monotonic()
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME + "_unknown", timeout=0.3)
+        self.assertTrue(ip == None)
+        self.assertTrue(time.monotonic() - start_time < 1.5)
+
+        broker_discover.stop()
+
+
+    def test26_simulatedNetwork(self):
+
+        def simulate(count, seed):
+            network = ServiceDiscovery.simNetwork(seed=seed)
+            daemons = []
+            for i in range(count):
+                broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, transport=network.node())
+                broker_discover.setPort(1000+i)
+                broker_discover.run()
+                daemons.append(broker_discover)
+            network.advance(2)
+            return network, daemons
+
+
+        # Same seed, same election
+        results = []
+        for i in range(2):
+            network, daemons = simulate(100, 1)
+            results.append(([daemon.getPort() for daemon in daemons if daemon.isMaster()], network.delivered))
+        self.assertTrue(results[0] == results[1])
+
+
+        # A thousand daemons elect one master in virtual time
+        network, daemons = simulate(1000, 2)
+        masters = [daemon for daemon in daemons if daemon.isMaster()]
+        self.assertTrue(len(masters) == 1)
+
+        test1 = ServiceDiscovery.client(transport=network.node())
+        start_time = network.now
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port == masters[0].getPort())
+        self.assertTrue(network.now - start_time < 0.01)
+
+        changes = []
+        test1.watch(TEST_SERVICE_NAME, lambda service_name, ip, port: changes.append(port))
+        network.advance(1)
+
+
+        # The master host crashes, the rest take over
+        network.isolate(ip)
+        network.advance(5)
+        masters = [daemon for daemon in daemons if daemon.isMaster() and daemon is not masters[0]]
+        self.assertTrue(len(masters) == 1)
+        self.assertTrue(changes[-1] == masters[0].getPort())
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port == masters[0].getPort())
+
+
+    def test27_healthCheck(self):
+
+        healthy = {1001: True, 1002: True, 1003: True}
+        daemons = []
+        for port in healthy:
+            broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, health_check=lambda port=port: healthy[port], health_interval=0.1, health_failures=2)
+            broker_discover.setPort(port)
+            broker_discover.run()
+            daemons.append(broker_discover)
+
+        while [daemon.isMaster() for daemon in daemons].count(True) != 1:
+            time.sleep(0.01)
+        time.sleep(1)
+        master = [daemon for daemon in daemons if daemon.isMaster()][0]
+
+
+        # The backend behind the master hangs, a healthy backup takes over within a few intervals
+        healthy[master.getPort()] = False
+        start_time = time.monotonic()
+        while master.isMaster() or [daemon.isMaster() for daemon in daemons].count(True) != 1:
+            self.assertTrue(time.monotonic() - start_time < 1)
+            time.sleep(0.01)
+        self.assertFalse(master.isHealthy())
+
+        test1 = ServiceDiscovery.client(fast_lookup=True)
+        ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+        self.assertTrue(port != None and port != master.getPort())
+
+
+        # Once recovered it competes again without stealing mastery
+        healthy[master.getPort()] = True
+        time.sleep(0.5)
+        self.assertTrue(master.isHealthy())
+        self.assertTrue(master.stats()["health_failures"] == 0)
+        self.assertTrue([daemon.isMaster() for daemon in daemons].count(True) == 1)
+
+        for broker_discover in daemons:
+            broker_discover.stop()
+
+
+        # Built in probes
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        server_port = server.getsockname()[1]
+        self.assertTrue(ServiceDiscovery.tcpHealthCheck().healthy(server_port))
+        server.close()
+        self.assertFalse(ServiceDiscovery.tcpHealthCheck().healthy(server_port))
+
+        class healthHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200 if self.path == "/health" else 503)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), healthHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.assertTrue(ServiceDiscovery.httpHealthCheck("/health").healthy(server.server_address[1]))
+        self.assertFalse(ServiceDiscovery.httpHealthCheck("/other").healthy(server.server_address[1]))
+        server.shutdown()
+        server.server_close()
+
+
+    def test28_requestFlood(self):
+
+        # 10k requests per second from a handful of sources, every one sent twice
+        results = ServiceDiscovery.ServiceDiscoveryBench.measureFlood(TEST_SERVICE_NAME, 10000, 2, 5)
+        self.assertTrue(results != None)
+        self.assertTrue(results["master_kept"])
+        self.assertTrue(results["elections"] == 0)
+        self.assertTrue(results["requests_coalesced"] > 0)
+        self.assertTrue(results["requests_rate_limited"] > 0)
+        self.assertTrue(results["requests_answered"] < results["requests_received"] / 2)
+
+        # Lookups from other clients are still answered promptly
+        self.assertTrue(results["lookups"] > 0 and results["errors"] == 0)
+        self.assertTrue(results["max_ms"] < 1000)
+
+
+        # A client looking up in a tight loop is neither coalesced nor limited
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME)
+        broker_discover.run()
+        test1 = ServiceDiscovery.client(fast_lookup=True, persistent=True)
+        for i in range(50):
+            ip, port = test1.getServiceIPAndPort(TEST_SERVICE_NAME)
+            self.assertTrue(ip != None)
+        stats = broker_discover.stats()
+        self.assertTrue(stats["requests_coalesced"] == 0 and stats["requests_rate_limited"] == 0)
+        test1.close()
+        broker_discover.stop()
+
+
+        # Shared client sockets resolving many services are not limited either
+        host = ServiceDiscovery.daemonHost()
+        service_names = [TEST_SERVICE_NAME + str(i) for i in range(150)]
+        for i, service_name in enumerate(service_names):
+            host.register(service_name, 1000 + i)
+        host.run()
+        while not all(host.isMaster(service_name) for service_name in service_names):
+            time.sleep(0.01)
+
+        test1 = ServiceDiscovery.client(fast_lookup=True, persistent=True, cache_ttl=0)
+        start_time = time.monotonic()
+        for i, service_name in enumerate(service_names):
+            ip, port = test1.getServiceIPAndPort(service_name)
+            self.assertTrue(port == 1000 + i)
+        self.assertTrue(time.monotonic() - start_time < 1)
+        test1.close()
+
+        async def lookup():
+            async with ServiceDiscovery.asyncClient() as test1:
+                return await asyncio.gather(*[test1.getServiceIPAndPort(service_name) for service_name in service_names])
+
+        start_time = time.monotonic()
+        results = asyncio.run(lookup())
+        self.assertTrue(time.monotonic() - start_time < 0.3)
+        self.assertTrue([port for ip, port in results] == [1000 + i for i in range(150)])
+        self.assertTrue(host.stats()["requests_rate_limited"] == 0)
+        host.stop()
+
+
+        # A new reply port in every request still drains the bucket shared by the source ip
+        broker_discover = ServiceDiscovery.daemon(TEST_SERVICE_NAME, request_rate=2, request_burst=1)
+        broker_discover.run()
+        while not broker_discover.isMaster():
+            time.sleep(0.01)
+        mcast_send_request = ServiceDiscovery.mcast(ServiceDiscovery.constants.MCAST_DISCOVER_GRP, ServiceDiscovery.constants.MCAST_DISCOVER_SERVER_PORT)
+        request = ServiceDiscovery.constants.DISCOVER_MSG_REQUEST.replace(ServiceDiscovery.constants.SERVICE_LABEL, TEST_SERVICE_NAME)
+        for i in range(2000):
+            mcast_send_request.send((request + "#%d#0" % (20000 + i)).encode())
+            if i % 100 == 0:
+                time.sleep(0.01)
+        time.sleep(0.5)
+        stats = broker_discover.stats()
+        self.assertTrue(stats["requests_received"] > 1000)
+        self.assertTrue(stats["requests_answered"] < stats["requests_received"] / 2)
+        self.assertTrue(stats["requests_rate_limited"] > stats["requests_received"] / 2)
+        mcast_send_request.close()
+        broker_discover.stop()
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
\ No newline at end of file